@@ -0,0 +1,119 @@
+# archive
+#
+# Metadata for the saved drafts, kept in data/index.json so the file browser
+# can list thousands of them without opening any. Drafts are snapshots in a
+# snapshot.SnapshotStore, or plain zw_*.txt files in data/ (older drafts, and
+# exported ones).
+#
+# Each entry has the file's mtime, size, word count, first line and a sha1 of
+# its contents. A save updates its own entry; refresh() only stats the
+# directory and re-reads files whose mtime or size no longer match.
+
+import os
+import json
+import shutil
+import fnmatch
+import hashlib
+import iostats
+
+INDEX_NAME = 'index.json'
+PATTERN = 'zw_*.txt'
+
+
+def describe(path):
+    # metadata for one file, reading it once
+    digest = hashlib.sha1()
+    words = 0
+    first_line = None
+    partial = b''
+    with open(path, 'rb') as file:
+        stat = os.fstat(file.fileno())
+        for chunk in iter(lambda: file.read(65536), b''):
+            digest.update(chunk)
+            chunk = partial + chunk
+            # a word split across chunks is counted with the next chunk
+            cut = max(chunk.rfind(b' '), chunk.rfind(b'\n'), chunk.rfind(b'\t'))
+            partial = chunk[cut + 1:]
+            words += len(chunk[:cut + 1].split())
+            if first_line is None:
+                for line in chunk[:cut + 1].split(b'\n'):
+                    if line.strip():
+                        first_line = line.strip().decode('utf-8', errors='replace')[:80]
+                        break
+        words += len(partial.split())
+        if first_line is None and partial.strip():
+            first_line = partial.strip().decode('utf-8', errors='replace')[:80]
+    return {
+        'mtime': stat.st_mtime,
+        'size': stat.st_size,
+        'words': words,
+        'first_line': first_line or "",
+        'sha1': digest.hexdigest(),
+    }
+
+
+class ArchiveIndex:
+    def __init__(self, directory, store=None):
+        self.directory = directory
+        self.store = store
+        self.index_path = os.path.join(directory, INDEX_NAME)
+        self.entries = {}  # file name -> metadata
+        try:
+            with open(self.index_path, 'r') as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(self.entries, file)
+            written = file.tell()
+        os.replace(temp_path, self.index_path)
+        iostats.count('index', written)
+
+    def update(self, path, name=None):
+        # call after writing an archive file, or after snapshotting path as name
+        info = describe(path)
+        if name is not None:
+            info['snapshot'] = True
+        self.entries[name or os.path.basename(path)] = info
+        self.save()
+
+    def refresh(self):
+        # bring the index in line with the directory, reading only changed files
+        seen = set()
+        changed = False
+        for entry in os.scandir(self.directory):
+            if not fnmatch.fnmatch(entry.name, PATTERN) or not entry.is_file():
+                continue
+            seen.add(entry.name)
+            stat = entry.stat()
+            known = self.entries.get(entry.name)
+            if known is not None and known.get('snapshot'):
+                continue  # an exported snapshot, described already
+            if known is None or known['mtime'] != stat.st_mtime or known['size'] != stat.st_size:
+                self.entries[entry.name] = describe(entry.path)
+                changed = True
+        if self.store is not None:
+            seen.update(self.store.names())
+        for name in list(self.entries):
+            if name not in seen:
+                del self.entries[name]
+                changed = True
+        if changed:
+            self.save()
+
+    def listing(self):
+        # (name, metadata) newest first
+        return sorted(self.entries.items(), key=lambda item: item[1]['mtime'], reverse=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def restore(self, name, path):
+        # copy a draft to path as plain text
+        if self.store is not None and self.store.has(name):
+            self.store.restore(name, path)
+        else:
+            shutil.copyfile(self.path(name), path)
@@ -0,0 +1,37 @@
+# autosave
+#
+# When to save without being asked: once typing has paused for IDLE seconds,
+# or once CHARS characters have changed since the last save, so text that was
+# never followed by enter survives a crash. Saves are at least MIN_INTERVAL
+# seconds apart, which keeps the card to a few writes a minute however fast
+# or long the typing goes. What is saved is the whole document as it is then,
+# the line being typed included, and the saver.Saver folds a save still queued
+# into the new one.
+
+IDLE = 3.0
+CHARS = 200
+MIN_INTERVAL = 10.0
+
+
+class Autosave:
+    def __init__(self, now, idle=IDLE, chars=CHARS, min_interval=MIN_INTERVAL):
+        self.idle = idle
+        self.chars = chars
+        self.min_interval = min_interval
+        self.saved(now)
+
+    def edit(self, changed, now):
+        # changed characters were typed, deleted or broken into paragraphs
+        self.dirty += changed
+        self.last_edit = now
+
+    def saved(self, now):
+        # the document was just saved, for whatever reason
+        self.dirty = 0
+        self.last_edit = now
+        self.last_save = now
+
+    def due(self, now):
+        if not self.dirty or now - self.last_save < self.min_interval:
+            return False
+        return now - self.last_edit >= self.idle or self.dirty >= self.chars
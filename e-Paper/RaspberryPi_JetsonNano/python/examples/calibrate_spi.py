@@ -0,0 +1,91 @@
+#
+# ZeroWriter SPI clock calibration
+#
+# The panel driver picks a conservative SPI clock (SPI_SPEED_HZ in new4in26part.py).
+# Most units run the bus a lot faster, which cuts the time spent pushing each frame.
+# This steps the clock up and shows a test pattern at every step: press y if the
+# screen looks clean, n (or esc) as soon as it shows noise, missing lines or garbage.
+# The fastest clean clock is saved to spi_speed.conf, which main.py uses on start.
+#
+# run it the same way as main.py:  sudo python calibrate_spi.py
+# setting EPD_SPI_HZ in the environment overrides both the profile and the calibration.
+#
+
+import os
+import time
+import keyboard
+import epdconfig
+import new4in26part
+from PIL import Image, ImageDraw, ImageFont
+
+spi_speed_path = os.path.join(os.path.dirname(__file__), 'spi_speed.conf')
+
+# clocks to try, slowest first (the Pi rounds down to the nearest divider it has)
+SPI_STEPS_HZ = [4000000, 6000000, 8000000, 10000000, 12000000, 16000000, 20000000, 24000000, 32000000]
+
+epd = new4in26part.EPD()
+font24 = ImageFont.truetype('Courier Prime.ttf', 32)
+
+def test_pattern(hz):
+    image = Image.new('1', (epd.width, epd.height), 255)
+    draw = ImageDraw.Draw(image)
+    # fine detail is where a marginal clock shows up first
+    for x in range(0, epd.width, 4):
+        draw.line((x, 0, x, 120), fill=0)
+    for y in range(130, 250, 4):
+        draw.line((0, y, epd.width, y), fill=0)
+    for y in range(260, 380, 8):
+        for x in range((y // 8) % 2 * 8, epd.width, 16):
+            draw.rectangle((x, y, x + 7, y + 7), fill=0)
+    draw.text((10, 390), f"SPI clock: {hz / 1000000:g} MHz", font=font24, fill=0)
+    draw.text((10, 430), "Clean? y = yes, n = no", font=font24, fill=0)
+    return epd.getbuffer(image)
+
+def show_message(text):
+    image = Image.new('1', (epd.width, epd.height), 255)
+    ImageDraw.Draw(image).text((10, 220), text, font=font24, fill=0)
+    epd.display(epd.getbuffer(image))
+
+def calibrate():
+    best = None
+    for hz in SPI_STEPS_HZ:
+        epdconfig.set_spi_speed(hz)
+        epd.init_Partial()
+        epd.display(test_pattern(hz))
+        print(f"SPI clock {hz} Hz - clean? (y/n)")
+
+        while True:
+            event = keyboard.read_event()
+            if event.event_type == keyboard.KEY_DOWN and event.name in ("y", "n", "esc"):
+                break
+        if event.name != "y":
+            break
+        best = hz
+    return best
+
+if os.environ.get('EPD_SPI_HZ'):
+    print("EPD_SPI_HZ is set and would override any calibration, unset it first")
+    exit(1)
+
+epd.init()
+epd.Clear()
+best = calibrate()
+
+if best is None:
+    best = new4in26part.SPI_SPEED_HZ
+    print(f"no clean step, keeping the profile clock of {best} Hz")
+else:
+    with open(spi_speed_path, 'w') as file:
+        file.write(f"{best}\n")
+    print(f"saved {best} Hz to {spi_speed_path}")
+
+#back to a known good clock and a clean screen
+epdconfig.set_spi_speed(best)
+epd.init()
+epd.Clear()
+epd.init_Partial()
+show_message(f"SPI clock set to {best / 1000000:g} MHz")
+time.sleep(2)
+epd.init()
+epd.Clear()
+epd.sleep()
@@ -0,0 +1,372 @@
+# document
+#
+# The text being written, stored as paragraphs: one paragraph per line in the
+# saved file, with no hard breaks from the display. Wrapping into display lines
+# is done with a wordwrap.WordWrap when a paragraph is shown, and only the
+# paragraphs on screen keep their line breaks around.
+#
+# A loaded file stays on disk: its paragraphs are read through a mmap'd
+# lineindex.LineIndex when they are needed, so opening a long file costs its
+# saved line index plus laying out one screen. The document is a list of
+# pieces, each either a range of loaded line numbers or a list of paragraphs
+# as Python strings. Editing a loaded paragraph cuts its range around it and
+# puts just that paragraph in a list, so what an edit costs doesn't depend on
+# how long the file is, and a save copies the ranges straight from the file.
+# The saved line index is cut back to the first loaded paragraph that isn't
+# where it was, and only what follows it is scanned when the file is reopened.
+#
+# Any paragraph can be edited; only its display lines from the edit on are
+# wrapped again. Each paragraph's number of display lines is kept once it is
+# laid out, with a running total: scrolling back counts only the screens it
+# passes, and the rest of a loaded file is counted a few paragraphs at a time
+# with count_lines() while the editor is idle. The last display line of the last paragraph is the input line.
+# Every change bumps version, and the lock lets pages be laid out on another
+# thread while typing goes on.
+
+import os
+import itertools
+from bisect import bisect_right
+import threading
+import lineindex
+import saver
+
+# versions are unique across documents, so caches keyed by one can't mix them up
+versions = itertools.count(1)
+COPY_BLOCK = 64 * 1024  # bytes of the loaded text copied at a time when saving
+
+
+class Document:
+    def __init__(self, wrap):
+        self.wrap = wrap
+        self.base = None  # LineIndex of the loaded file
+        self.pieces = [[""]]  # ranges of loaded lines and lists of paragraphs, in order
+        self.firsts = [0]  # paragraph index each piece starts at
+        self.total = 1  # paragraphs in all the pieces
+        self.layout = {}  # paragraph index -> line breaks, for the paragraphs on screen
+        self.counts = {}  # paragraph index -> number of display lines, once laid out
+        self.counted = 0  # display lines in counts
+        self.uncounted = 1  # every paragraph from this index on is in counts
+        self.version = next(versions)
+        self.changed_from = 0  # first paragraph changed since take_changed(), None if none
+        self.lock = threading.RLock()
+
+    def load(self, path):
+        base = lineindex.LineIndex(path)
+        with self.lock:
+            self.close()
+            self.base = base
+            # typing continues in a new paragraph after the loaded text
+            self.pieces = [range(len(base)), [""]]
+            self.number()
+            self.layout = {}
+            self.reset_counts()
+            self.version = next(versions)
+            self.changed_from = 0
+
+    def number(self):
+        # drop empty pieces, merge neighbouring lists and index where each starts
+        pieces = []
+        for piece in self.pieces:
+            if not len(piece):
+                continue
+            if pieces and isinstance(piece, list) and isinstance(pieces[-1], list):
+                piece[:0] = pieces.pop()
+            pieces.append(piece)
+        self.pieces = pieces or [[""]]
+        self.firsts = list(itertools.accumulate([0] + [len(piece) for piece in self.pieces[:-1]]))
+        self.total = self.firsts[-1] + len(self.pieces[-1])
+
+    def reset_counts(self):
+        self.counts = {}
+        self.counted = 0
+        self.uncounted = self.total
+
+    def set_count(self, index, count):
+        self.counted += count - self.counts.get(index, 0)
+        self.counts[index] = count
+
+    def locate(self, index):
+        # (piece number, index within it) of paragraph index
+        i = bisect_right(self.firsts, index) - 1
+        return i, index - self.firsts[i]
+
+    def take_changed(self):
+        # the first paragraph changed since the last call, None if nothing was
+        with self.lock:
+            first = self.changed_from
+            self.changed_from = None
+            return first
+
+    def changed(self, index):
+        if self.changed_from is None or index < self.changed_from:
+            self.changed_from = index
+
+    def spans(self, piece):
+        # (start, stop, newline to add) bytes of the file holding a range of loaded lines
+        starts = self.base.starts
+
+        def offset(line):
+            return starts[line] if line < len(starts) else self.base.end
+        if piece.stop > len(starts):
+            # the last line, with no newline in the file yet
+            return offset(piece.start), self.base.size, True
+        return offset(piece.start), offset(piece.stop), False
+
+    def snapshot(self):
+        # a function writing the document as it is now to a file, for saver.Saver.
+        # Saves replace the loaded file by renaming, never rewrite it, so the loaded
+        # ranges are copied a block at a time from a handle of our own on it when
+        # the save is written, even after the document has moved on or been closed.
+        # The handle shares its file position with the document's, so it is read
+        # with pread.
+        with self.lock:
+            source = None
+            if self.base is not None and any(isinstance(piece, range) for piece in self.pieces):
+                source = os.fdopen(os.dup(self.base.file.fileno()), 'rb')
+            parts = [self.spans(piece) if isinstance(piece, range) else list(piece) for piece in self.pieces]
+        if isinstance(parts[-1], list) and parts[-1][-1] == "":
+            parts[-1] = parts[-1][:-1]
+
+        def write(file):
+            try:
+                for part in parts:
+                    if isinstance(part, list):
+                        file.write("".join(paragraph + '\n' for paragraph in part).encode('utf-8'))
+                        continue
+                    offset, stop, newline = part
+                    while offset < stop:
+                        block = os.pread(source.fileno(), min(COPY_BLOCK, stop - offset), offset)
+                        if not block:
+                            break
+                        file.write(block)
+                        offset += len(block)
+                    if newline:
+                        file.write(b'\n')
+            finally:
+                if source is not None:
+                    source.close()
+        return write
+
+    def save(self, path):
+        saver.write_atomic(path, self.snapshot())
+
+    def close(self):
+        # what was typed or edited stays, the loaded paragraphs go with the file
+        if self.base is not None:
+            self.base.close()
+            self.base = None
+            self.pieces = [piece for piece in self.pieces if isinstance(piece, list)]
+            self.number()
+            self.layout = {}
+            self.reset_counts()
+
+    def clear(self):
+        with self.lock:
+            self.close()
+            self.pieces = [[""]]
+            self.number()
+            self.layout = {}
+            self.reset_counts()
+            self.version = next(versions)
+            self.changed_from = 0
+
+    def totals(self):
+        # (words, chars) of the whole document, counted once when it is opened
+        with self.lock:
+            words = chars = 0
+            for piece in self.pieces:
+                if isinstance(piece, range):
+                    start, stop, _ = self.spans(piece)
+                    data = self.base.map[start:stop]
+                    words += len(data.split())
+                    chars += len(data.decode('utf-8', errors='replace')) - data.count(b'\n')
+                    continue
+                for paragraph in piece:
+                    words += len(paragraph.split())
+                    chars += len(paragraph)
+            return words, chars
+
+    def memory(self):
+        # rough bytes held as Python objects, the mapped file doesn't count
+        with self.lock:
+            held = [piece for piece in self.pieces if isinstance(piece, list)]
+            return (sum(len(paragraph) for piece in held for paragraph in piece)
+                    + 64 * (sum(len(piece) for piece in held) + len(self.counts) + len(self.pieces))
+                    + 100 * len(self.layout))
+
+    def count(self):
+        return self.total
+
+    def paragraph(self, index):
+        with self.lock:
+            i, at = self.locate(index)
+            piece = self.pieces[i]
+            if isinstance(piece, range):
+                return self.base.line(piece[at])
+            return piece[at]
+
+    def breaks(self, index):
+        with self.lock:
+            breaks = self.layout.get(index)
+            if breaks is None:
+                breaks = self.wrap.breaks(self.paragraph(index))
+                self.layout[index] = breaks
+                self.set_count(index, len(breaks))
+            return breaks
+
+    def lines(self, index):
+        with self.lock:
+            return self.wrap.lines(self.paragraph(index), self.breaks(index))
+
+    def input_line(self):
+        with self.lock:
+            return self.lines(self.count() - 1)[-1]
+
+    def line_at(self, index, pos):
+        # which display line of the paragraph the text offset pos is on
+        return bisect_right(self.breaks(index), pos) - 1
+
+    def materialize(self, index):
+        # make loaded paragraph index a string in a list so it can be edited,
+        # returns (list, index within it)
+        with self.lock:
+            i, at = self.locate(index)
+            piece = self.pieces[i]
+            if isinstance(piece, range):
+                self.pieces[i:i + 1] = [piece[:at], [self.base.line(piece[at])], piece[at + 1:]]
+                self.number()
+                # the file is the same as loaded up to the first range that moved
+                first = self.pieces[0]
+                self.base.keep(first.stop if isinstance(first, range) and first.start == 0 else 0)
+                i, at = self.locate(index)
+            return self.pieces[i], at
+
+    def renumber(self, index, delta):
+        # paragraphs after index moved by delta
+        self.layout = {(i + delta if i > index else i): b for i, b in self.layout.items()}
+        self.counts = {(i + delta if i > index else i): c for i, c in self.counts.items()}
+        if self.uncounted > index:
+            self.uncounted += delta
+
+    def forget(self, *indexes):
+        for index in indexes:
+            self.layout.pop(index, None)
+            self.counted -= self.counts.pop(index, 0)
+
+    def edit(self, index, pos, removed, inserted):
+        # replace removed chars at pos in paragraph index with inserted and re-wrap
+        # only the lines from the edit on
+        with self.lock:
+            paragraphs, at = self.materialize(index)
+            text = paragraphs[at]
+            old_breaks = self.breaks(index)
+            text = text[:pos] + inserted + text[pos + removed:]
+            paragraphs[at] = text
+            breaks = self.wrap.reflow(text, old_breaks, pos, removed, len(inserted))
+            self.layout[index] = breaks
+            self.set_count(index, len(breaks))
+            self.changed(index)
+            self.version = next(versions)
+
+    def split(self, index, pos):
+        # paragraph index ends at pos and the rest of it starts the next one
+        with self.lock:
+            paragraphs, at = self.materialize(index)
+            text = paragraphs[at]
+            paragraphs[at:at + 1] = [text[:pos], text[pos:]]
+            self.number()
+            self.renumber(index, 1)
+            self.forget(index, index + 1)
+            self.breaks(index)
+            self.breaks(index + 1)
+            self.changed(index)
+            self.version = next(versions)
+
+    def join(self, index):
+        # paragraph index is appended to the one before it, returns where
+        with self.lock:
+            self.materialize(index - 1)
+            paragraphs, at = self.materialize(index)  # the list with index - 1 in it too
+            pos = len(paragraphs[at - 1])
+            paragraphs[at - 1:at + 1] = [paragraphs[at - 1] + paragraphs[at]]
+            self.number()
+            self.forget(index - 1, index)
+            self.renumber(index, -1)
+            self.breaks(index - 1)
+            self.changed(index - 1)
+            self.version = next(versions)
+            return pos
+
+    def count_paragraph(self, index):
+        # display lines of paragraph index, laid out for the count only if it isn't on screen
+        count = self.counts.get(index)
+        if count is None:
+            count = len(self.wrap.breaks(self.paragraph(index)))
+            self.set_count(index, count)
+        return count
+
+    def count_lines(self, budget=None):
+        # count the display lines of up to budget more paragraphs, from the end
+        # back, so the whole document's count is known once it returns True
+        with self.lock:
+            stop = 0 if budget is None else max(0, self.uncounted - budget)
+            for index in range(self.uncounted - 1, stop - 1, -1):
+                self.count_paragraph(index)
+            self.uncounted = stop
+            return stop == 0
+
+    def line_count(self, limit=None):
+        # display lines in the whole document. With a limit, counting back from the
+        # end stops once there are that many, so scrolling back a few screens only
+        # lays out the paragraphs on them. Paragraphs off screen are laid out for
+        # their count only, their breaks are not kept.
+        with self.lock:
+            if limit is None:
+                self.count_lines()
+            if self.uncounted == 0:
+                return self.counted if limit is None else min(self.counted, limit)
+            total = 0
+            for index in range(self.count() - 1, -1, -1):
+                total += self.count_paragraph(index)
+                if total >= limit:
+                    return limit
+            return total
+
+    def known_line_count(self):
+        # line_count() if it is known without laying anything out, else None
+        with self.lock:
+            return self.counted if self.uncounted == 0 else None
+
+    def lines_after(self, index, line):
+        # display lines after line of paragraph index, to the end of the document
+        with self.lock:
+            total = self.count_paragraph(index) - line - 1
+            for i in range(index + 1, self.count()):
+                total += self.count_paragraph(i)
+            return total
+
+    def page_lines(self, scroll, count):
+        # the lines above the input line that are on screen when scrolled back
+        # scroll screens (1 is the newest), as (paragraph, line, text). The top
+        # screen is always a full one.
+        need = scroll * count + 1
+        chunks = []
+        have = 0
+        with self.lock:
+            index = self.count()
+            while index > 0 and have < need:
+                index -= 1
+                lines = self.lines(index)
+                chunks.append([(index, line, text) for line, text in enumerate(lines)])
+                have += len(lines)
+
+            # forget the layout of paragraphs that scrolled off, except the current one
+            last = self.count() - 1
+            self.layout = {i: b for i, b in self.layout.items() if i >= index or i == last}
+
+        above = [line for chunk in reversed(chunks) for line in chunk][:-1]
+        start = max(0, len(above) - scroll * count)
+        return above[start:start + count]
+
+    def page(self, scroll, count):
+        return [text for _, _, text in self.page_lines(scroll, count)]
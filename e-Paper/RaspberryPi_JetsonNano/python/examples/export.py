@@ -0,0 +1,200 @@
+# export
+#
+# Drafts out as Markdown, HTML or EPUB, to take off the card without
+# reformatting. Everything streams: paragraphs are read a line (or a snapshot
+# chunk) at a time, each format is a generator turning paragraphs into pieces
+# of output, and the pieces go straight to the file. A 200k word manuscript
+# never has more than a paragraph and a chunk in memory at once.
+#
+# An EPUB is a zip; its text is split into chapter files of about CHAPTER_BYTES
+# as it streams, and the package and navigation files listing them are written
+# last. Exports run one at a time on the Exporter's worker thread, which keeps
+# progress (bytes of the draft read so far) for the status area.
+
+import io
+import re
+import html
+import queue
+import zipfile
+import threading
+import saver
+
+FORMATS = {'md': 'Markdown', 'html': 'HTML', 'epub': 'EPUB'}
+CHAPTER_BYTES = 64 * 1024
+
+MARKDOWN_START = re.compile(r'^(\s*\d*)([#>*+=`|.)-])')
+
+
+def file_lines(path):
+    # lines of a plain file, with how many bytes were read so far
+    with open(path, 'rb') as file:
+        read = 0
+        for line in file:
+            read += len(line)
+            yield line, read
+
+
+def chunk_lines(store, name):
+    # lines of a snapshot, read a chunk at a time
+    partial = b''
+    read = 0
+    for digest, length in store.manifest(name)['chunks']:
+        read += length
+        lines = (partial + store.read_chunk(digest)).split(b'\n')
+        partial = lines.pop()
+        for line in lines:
+            yield line + b'\n', read
+    if partial:
+        yield partial, read
+
+
+def paragraphs(lines, progress):
+    # non-empty paragraphs of a line stream, reporting bytes read to progress
+    for line, read in lines:
+        progress(read)
+        text = line.decode('utf-8', errors='replace').rstrip('\r\n')
+        if text.strip():
+            yield text
+
+
+def markdown(title, paragraphs):
+    yield f"# {title}\n\n"
+    for text in paragraphs:
+        # a paragraph that would start a heading, quote or list stays plain text
+        yield MARKDOWN_START.sub(lambda match: match.group(1) + '\\' + match.group(2), text) + "\n\n"
+
+
+def html_page(title, paragraphs):
+    yield ('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+           f'<title>{html.escape(title)}</title>\n</head>\n<body>\n<h1>{html.escape(title)}</h1>\n')
+    for text in paragraphs:
+        yield f"<p>{html.escape(text)}</p>\n"
+    yield '</body>\n</html>\n'
+
+
+def xhtml_head(title):
+    return ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n'
+            f'<head>\n<title>{html.escape(title)}</title>\n</head>\n<body>\n')
+
+
+def epub_chapters(title, paragraphs):
+    # (chapter number, piece) for each piece of chapter xhtml, a chapter is
+    # started whenever the one before reaches CHAPTER_BYTES
+    chapter = 1
+    size = 0
+    yield chapter, xhtml_head(title) + f"<h1>{html.escape(title)}</h1>\n"
+    for text in paragraphs:
+        if size >= CHAPTER_BYTES:
+            yield chapter, '</body>\n</html>\n'
+            chapter += 1
+            size = 0
+            yield chapter, xhtml_head(title)
+        piece = f"<p>{html.escape(text)}</p>\n"
+        size += len(piece)
+        yield chapter, piece
+    yield chapter, '</body>\n</html>\n'
+
+
+def write_epub(file, title, identifier, paragraphs):
+    with zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED) as epub:
+        # the mimetype comes first and uncompressed, readers check for it
+        epub.writestr(zipfile.ZipInfo('mimetype'), 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+        epub.writestr('META-INF/container.xml',
+                      '<?xml version="1.0" encoding="utf-8"?>\n'
+                      '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">\n'
+                      '<rootfiles><rootfile full-path="OEBPS/content.opf" '
+                      'media-type="application/oebps-package+xml"/></rootfiles>\n</container>\n')
+
+        chapters = 0
+        out = None
+        for chapter, piece in epub_chapters(title, paragraphs):
+            if chapter != chapters:
+                if out is not None:
+                    out.close()
+                out = io.TextIOWrapper(epub.open(f'OEBPS/chapter{chapter}.xhtml', 'w'), encoding='utf-8')
+                chapters = chapter
+            out.write(piece)
+        out.close()
+
+        names = [f'chapter{chapter}' for chapter in range(1, chapters + 1)]
+        epub.writestr('OEBPS/nav.xhtml', xhtml_head(title)
+                      + '<nav epub:type="toc">\n<ol>\n'
+                      + "".join(f'<li><a href="{name}.xhtml">Part {i}</a></li>\n' for i, name in enumerate(names, 1))
+                      + '</ol>\n</nav>\n</body>\n</html>\n')
+        epub.writestr('OEBPS/content.opf',
+                      '<?xml version="1.0" encoding="utf-8"?>\n'
+                      '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id">\n'
+                      '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+                      f'<dc:identifier id="id">{html.escape(identifier)}</dc:identifier>\n'
+                      f'<dc:title>{html.escape(title)}</dc:title>\n<dc:language>en</dc:language>\n'
+                      '<meta property="dcterms:modified">2000-01-01T00:00:00Z</meta>\n'
+                      '</metadata>\n<manifest>\n'
+                      '<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>\n'
+                      + "".join(f'<item id="{name}" href="{name}.xhtml" media-type="application/xhtml+xml"/>\n'
+                                for name in names)
+                      + '</manifest>\n<spine>\n'
+                      + "".join(f'<itemref idref="{name}"/>\n' for name in names)
+                      + '</spine>\n</package>\n')
+
+
+def write(fmt, title, identifier, paragraphs):
+    # a write(file) function for saver.write_atomic
+    def write_file(file):
+        if fmt == 'epub':
+            write_epub(file, title, identifier, paragraphs)
+            return
+        pieces = markdown(title, paragraphs) if fmt == 'md' else html_page(title, paragraphs)
+        out = io.TextIOWrapper(file, encoding='utf-8', write_through=True)
+        for piece in pieces:
+            out.write(piece)
+        out.detach()
+    return write_file
+
+
+class Exporter:
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.worker = None
+        self.lock = threading.Lock()
+        self.current = None  # (format, path) being exported
+        self.read = 0
+        self.total = 0
+
+    def export(self, fmt, title, lines, total, path, done=None):
+        # queue an export of a line stream of total bytes, done(path) after it is written
+        self.jobs.put((fmt, title, lines, total, path, done))
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run, daemon=True)
+            self.worker.start()
+
+    def run(self):
+        while True:
+            fmt, title, lines, total, path, done = self.jobs.get()
+            with self.lock:
+                self.current = (fmt, path)
+                self.read = 0
+                self.total = total
+            try:
+                saver.write_atomic(path, write(fmt, title, path, paragraphs(lines, self.advance)), 'export')
+                if done is not None:
+                    done(path)
+            except Exception as error:
+                print(f"export of {path} failed: {error}")
+            with self.lock:
+                self.current = None
+            self.jobs.task_done()
+
+    def flush(self):
+        # wait until everything queued so far is written
+        self.jobs.join()
+
+    def advance(self, read):
+        self.read = read
+
+    def progress(self):
+        # (format, percent done) of the export running now, or None
+        with self.lock:
+            if self.current is None:
+                return None
+            return self.current[0], 100 * self.read // max(1, self.total)
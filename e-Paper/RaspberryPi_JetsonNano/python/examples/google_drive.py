@@ -1,30 +1,424 @@
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-from google.oauth2 import service_account
+# google_drive
+#
+# Uploads to Google Drive. The API client is built once, the first time it is
+# needed, and reused: building it reads the credentials and the discovery
+# document, which takes seconds on a Pi Zero. The google libraries are only
+# imported then too, so the editor runs without them.
+#
+# DriveSync keeps uploads in a queue on disk (data/sync/queue.json) and sends
+# them from a background thread, so saving works offline and nothing queued is
+# lost to a reboot. Like the Saver, queueing a file that is already waiting
+# keeps one entry for it, the file is read when it is sent. An upload that
+# failed because the network is down or the API answered 429/5xx is retried
+# after BACKOFF_START seconds, doubling up to BACKOFF_MAX. Any other failure (a
+# local error, or the API refusing the upload), or MAX_ATTEMPTS failures in a
+# row, parks the file in the queue instead: it is only tried again when it is
+# queued again, and can't hold up the files behind it. Credentials that are
+# missing or refused stop the worker altogether, with the error kept in stats()
+# and printed once; the queue waits on the card for the next start.
+#
+# sync() queues only what changed: data/sync/manifest.json has the size, mtime,
+# sha1 and Drive id of every document last uploaded. Files whose size and mtime
+# still match are skipped without being read, so a sync where nothing changed
+# makes no network calls. A file already on Drive is updated in place; the ids
+# of queued files that have none yet are looked up by name BATCH_SIZE at a time
+# in one batch request, so a lost manifest doesn't lead to duplicates, and
+# their md5 tells which of them are already up to date. The manifest and the
+# queue are written when the queue empties, or every MANIFEST_EVERY uploads;
+# after a crash a few files are checked again, never sent twice as new files.
+#
+# api_endpoint points the client at another server, such as a local stand-in
+# for the Drive API, which is then called without credentials.
 
-def get_drive_service(credentials_path, scopes):
+import os
+import json
+import time
+import errno
+import socket
+import http.client
+import random
+import fnmatch
+import hashlib
+import threading
+from collections import OrderedDict
+import saver
+
+CREDENTIALS_PATH = 'path/to/your/credentials.json'
+SCOPES = ['https://www.googleapis.com/auth/drive']
+SYNC_DIR = 'sync'
+QUEUE_NAME = 'queue.json'
+MANIFEST_NAME = 'manifest.json'
+SYNC_PATTERN = '*.txt'  # the documents and drafts in data/
+BATCH_SIZE = 100  # requests per batch, the most the Drive API takes
+MANIFEST_EVERY = 32
+BACKOFF_START = 5
+BACKOFF_MAX = 300
+MAX_ATTEMPTS = 8
+
+# OSErrors that mean the network is away, not that something is wrong here
+NETWORK_ERRNOS = {errno.ENETUNREACH, errno.ENETDOWN, errno.EHOSTUNREACH, errno.EHOSTDOWN,
+                  errno.ECONNREFUSED, errno.ECONNRESET, errno.ECONNABORTED, errno.ETIMEDOUT, errno.EPIPE}
+
+
+def get_drive_service(credentials_path, scopes, api_endpoint=None):
+    from googleapiclient.discovery import build, build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+
+    if api_endpoint is not None:
+        from google.auth.credentials import AnonymousCredentials
+        # the discovery document shipped with the library, with every url (uploads
+        # and batches too) moved to the other server
+        document = json.loads(get_static_doc('drive', 'v3'))
+        document['rootUrl'] = api_endpoint.rstrip('/') + '/'
+        document.pop('mtlsRootUrl', None)
+        return build_from_document(document, credentials=AnonymousCredentials())
+
+    from google.oauth2 import service_account
     # Load the service account credentials from the JSON key file
     credentials = service_account.Credentials.from_service_account_file(
         credentials_path, scopes=scopes
     )
 
-    # Create a Google Drive API client
-    drive_service = build('drive', 'v3', credentials=credentials)
+    # Create a Google Drive API client, from the discovery document shipped with the library
+    drive_service = build('drive', 'v3', credentials=credentials, static_discovery=True, cache_discovery=False)
     return drive_service
 
+
+class CredentialsError(Exception):
+    # the client can't be built with what is configured
+    pass
+
+
+def status(error):
+    return int(getattr(getattr(error, 'resp', None), 'status', 0) or 0)
+
+
+def network_error(error):
+    if isinstance(error, (ConnectionError, TimeoutError, socket.gaierror, http.client.HTTPException)):
+        return True
+    if isinstance(error, OSError) and error.errno in NETWORK_ERRNOS:
+        return True
+    # the transports below the client, only there if the libraries are
+    names = {cls.__module__.split('.')[0] + '.' + cls.__name__ for cls in type(error).__mro__}
+    return bool(names & {'httplib2.HttpLib2Error', 'google.TransportError'})
+
+
+def fatal(error):
+    # nothing will get through until the credentials are fixed
+    # (google.auth errors are about the credentials, except for its network ones)
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return (isinstance(error, CredentialsError) or status(error) == 401
+            or 'GoogleAuthError' in names and 'TransportError' not in names)
+
+
+def transient(error):
+    # worth trying again later: no answer at all, or the API asking us to wait
+    code = status(error)
+    if code:
+        return (code in (408, 429) or code >= 500
+                or code == 403 and b'ateLimitExceeded' in (getattr(error, 'content', None) or b''))
+    return network_error(error)
+
+
+def file_digest(path, algorithm='sha1'):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DriveClient:
+    # one API client, built when first used
+    def __init__(self, credentials_path=CREDENTIALS_PATH, api_endpoint=None, scopes=SCOPES):
+        self.credentials_path = credentials_path
+        self.api_endpoint = api_endpoint
+        self.scopes = scopes
+        self.drive_service = None
+        self.lock = threading.Lock()
+
+    def service(self):
+        with self.lock:
+            if self.drive_service is None:
+                try:
+                    self.drive_service = get_drive_service(self.credentials_path, self.scopes, self.api_endpoint)
+                except Exception as error:
+                    raise CredentialsError(f"no Drive client with {self.credentials_path}: {error}") from error
+            return self.drive_service
+
+    def create(self, file_path, name=None, parent_folder_id=None):
+        from googleapiclient.http import MediaFileUpload
+
+        # Prepare metadata for the file
+        file_metadata = {'name': name or os.path.basename(file_path)}
+        if parent_folder_id:
+            file_metadata['parents'] = [parent_folder_id]
+
+        # Upload the file
+        media = MediaFileUpload(file_path)
+        uploaded_file = self.service().files().create(
+            body=file_metadata, media_body=media, fields='id'
+        ).execute()
+
+        return uploaded_file.get('id')
+
+    def update(self, file_id, file_path):
+        # new content for an existing file, keeping its id
+        from googleapiclient.http import MediaFileUpload
+
+        media = MediaFileUpload(file_path)
+        return self.service().files().update(
+            fileId=file_id, media_body=media, fields='id'
+        ).execute().get('id')
+
+    def lookup(self, names, parent_folder_id=None):
+        # {name: (id, md5)} of the files on Drive with these names, newest if there are several
+        found = {}
+        errors = []
+
+        def answer(request_id, response, exception):
+            if exception is not None:
+                errors.append(exception)
+            elif response.get('files'):
+                found[names[int(request_id)]] = (response['files'][0]['id'], response['files'][0].get('md5Checksum'))
+
+        service = self.service()
+        for start in range(0, len(names), BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=answer)
+            for i in range(start, min(len(names), start + BATCH_SIZE)):
+                escaped = names[i].replace('\\', '\\\\').replace("'", "\\'")
+                query = f"name = '{escaped}' and trashed = false"
+                if parent_folder_id:
+                    query += f" and '{parent_folder_id}' in parents"
+                batch.add(service.files().list(q=query, orderBy='modifiedTime desc',
+                                               fields='files(id, md5Checksum)', pageSize=1), request_id=str(i))
+            batch.execute()
+        if errors:
+            raise errors[0]
+        return found
+
+
+_client = DriveClient()
+
+
 def upload_file(file_path, parent_folder_id=None):
-    # Initialize the Google Drive API client
-    drive_service = get_drive_service('path/to/your/credentials.json', ['https://www.googleapis.com/auth/drive'])
+    # upload now with the shared client, returns the new file's id
+    return _client.create(file_path, file_path, parent_folder_id)
+
+
+class DriveSync:
+    def __init__(self, directory, client=None, parent_folder_id=None):
+        self.directory = directory
+        self.client = client or _client
+        self.parent_folder_id = parent_folder_id
+        self.queue_path = os.path.join(directory, SYNC_DIR, QUEUE_NAME)
+        self.manifest_path = os.path.join(directory, SYNC_DIR, MANIFEST_NAME)
+        os.makedirs(os.path.dirname(self.queue_path), exist_ok=True)
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()  # path -> {'name', 'queued', 'attempts'}
+        self.parked = {}  # path -> entry, with the 'error' it was parked for
+        self.manifest = {}  # name -> {'mtime', 'size', 'sha1', 'id'} as last uploaded
+        self.unsaved = 0  # manifest changes not written yet
+        self.sending = None  # path being uploaded
+        self.delay = 0  # seconds to wait after the last failure
+        self.retry_at = 0
+        self.worker = None
+        self.error = None  # why the worker stopped for good
+        self.counters = {'uploads': 0, 'skipped': 0, 'failures': 0, 'parked': 0}
+        try:
+            with open(self.queue_path, 'r') as file:
+                queue = json.load(file)
+            self.pending.update(queue['pending'])
+            self.parked.update(queue['parked'])
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            pass
+        try:
+            with open(self.manifest_path, 'r') as file:
+                self.manifest.update(json.load(file))
+        except (FileNotFoundError, ValueError):
+            pass
+        if self.pending:
+            self.start()
+
+    def start(self):
+        if self.worker is None and self.error is None:
+            self.worker = threading.Thread(target=self.run, daemon=True)
+            self.worker.start()
+
+    def save_queue(self):
+        queue = json.dumps({'pending': self.pending, 'parked': self.parked}).encode('utf-8')
+        saver.write_atomic(self.queue_path, lambda out: out.write(queue), 'sync')
+
+    def save_manifest(self):
+        manifest = json.dumps(self.manifest).encode('utf-8')
+        saver.write_atomic(self.manifest_path, lambda out: out.write(manifest), 'sync')
+        self.unsaved = 0
+
+    def upload(self, path, name=None):
+        # queue path to be uploaded as name (its file name by default)
+        self.queue([(path, name or os.path.basename(path))])
+
+    def queue(self, files):
+        with self.cond:
+            for path, name in files:
+                self.pending.pop(path, None)
+                self.parked.pop(path, None)
+                self.pending[path] = {'name': name, 'queued': time.time(), 'attempts': 0}
+            self.save_queue()
+            self.cond.notify_all()
+        self.start()
+
+    def sync(self):
+        # queue every document in the directory that changed since it was last
+        # uploaded, returns how many. Only files whose size or mtime moved are read.
+        changed = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or not fnmatch.fnmatch(entry.name, SYNC_PATTERN):
+                    continue
+                stat = entry.stat()
+                with self.cond:
+                    known = self.manifest.get(entry.name)
+                if known and known['mtime'] == stat.st_mtime_ns and known['size'] == stat.st_size:
+                    continue
+                if known and known['sha1'] == file_digest(entry.path):
+                    # touched but the same, remember the new mtime so it isn't read again
+                    with self.cond:
+                        known.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+                        self.unsaved += 1
+                    continue
+                changed.append((entry.path, entry.name))
+        if changed:
+            self.queue(changed)
+        elif self.unsaved:
+            with self.cond:
+                self.save_manifest()
+        return len(changed)
+
+    def retry(self):
+        # try the queue again now instead of waiting out the backoff
+        with self.cond:
+            self.retry_at = 0
+            self.cond.notify_all()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending or time.time() < self.retry_at:
+                    self.cond.wait(None if not self.pending else self.retry_at - time.time())
+                path, entry = next(iter(self.pending.items()))
+                self.sending = path
+
+            error = None
+            sent = False
+            if os.path.exists(path):
+                try:
+                    sent = self.send(path, entry['name'])
+                except Exception as failure:
+                    error = failure
+
+            with self.cond:
+                self.sending = None
+                if error is not None and fatal(error):
+                    self.error = str(error)
+                    self.worker = None
+                    print(f"Drive sync stopped: {error}")
+                    self.cond.notify_all()
+                    return
+                if error is not None and transient(error):
+                    self.counters['failures'] += 1
+                    self.delay = min(BACKOFF_MAX, 2 * self.delay or BACKOFF_START)
+                    # spread out, so a flaky network isn't hit at fixed intervals
+                    self.retry_at = time.time() + self.delay * random.uniform(0.75, 1.25)
+                    # only answers from the API count against the file, an outage doesn't
+                    if status(error):
+                        entry['attempts'] = entry.get('attempts', 0) + 1
+                    if entry.get('attempts', 0) < MAX_ATTEMPTS:
+                        print(f"upload of {path} failed, retrying in {self.delay}s: {error}")
+                        continue
+                if error is not None:
+                    self.counters['parked'] += 1
+                    print(f"upload of {path} parked: {error}")
+                    if self.pending.get(path) is entry:
+                        self.parked[path] = dict(entry, error=str(error))
+                else:
+                    self.counters['uploads' if sent else 'skipped'] += 1
+                    self.delay = 0
+                # queued again while it was being sent: that one still has to go
+                if self.pending.get(path) is entry:
+                    del self.pending[path]
+                if not self.pending or self.unsaved >= MANIFEST_EVERY:
+                    self.save_queue()
+                    self.save_manifest()
+                self.cond.notify_all()
+
+    def send(self, path, name):
+        # upload one file unless Drive already has this content, True if it was sent
+        stat = os.stat(path)
+        digest = file_digest(path)
+        with self.cond:
+            looked_up = 'id' in self.manifest.get(name, {})
+        if not looked_up:
+            self.find(name)
+        with self.cond:
+            known = dict(self.manifest[name])
+        file_id = known['id']
+        if file_id and (known['sha1'] == digest or known.get('md5') and known['md5'] == file_digest(path, 'md5')):
+            self.remember(name, stat, digest, file_id)
+            return False
+
+        if file_id:
+            try:
+                file_id = self.client.update(file_id, path)
+            except Exception as error:
+                if status(error) != 404:
+                    raise
+                file_id = None  # deleted on Drive since
+        if not file_id:
+            file_id = self.client.create(path, name, self.parent_folder_id)
+        self.remember(name, stat, digest, file_id)
+        return True
+
+    def find(self, name):
+        # put the id and md5 of name on Drive in the manifest, along with those of
+        # every queued file not looked up yet, in the same batch
+        with self.cond:
+            names = [name] + [entry['name'] for entry in self.pending.values()
+                              if entry['name'] != name and 'id' not in self.manifest.get(entry['name'], {})]
+        found = self.client.lookup(names[:BATCH_SIZE], self.parent_folder_id)
+        with self.cond:
+            for other, (file_id, md5) in found.items():
+                # what is on Drive, to compare the file with when it is sent
+                self.manifest[other] = {'mtime': None, 'size': None, 'sha1': None, 'id': file_id, 'md5': md5}
+            self.unsaved += len(found)
+            for other in names[:BATCH_SIZE]:
+                if other not in found:
+                    # not on Drive, don't look it up again
+                    self.manifest.setdefault(other, {'mtime': None, 'size': None, 'sha1': None})['id'] = None
 
-    # Prepare metadata for the file
-    file_metadata = {'name': file_path}
-    if parent_folder_id:
-        file_metadata['parents'] = [parent_folder_id]
+    def remember(self, name, stat, digest, file_id):
+        with self.cond:
+            self.manifest[name] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'sha1': digest, 'id': file_id}
+            self.unsaved += 1
 
-    # Upload the file
-    media = MediaFileUpload(file_path)
-    uploaded_file = drive_service.files().create(
-        body=file_metadata, media_body=media, fields='id'
-    ).execute()
+    def flush(self, timeout=None):
+        # wait until the queue is empty, False if timeout seconds passed first
+        # or the worker stopped
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while (self.pending or self.sending) and self.error is None:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            return self.error is None
 
-    return uploaded_file.get('id')
+    def stats(self):
+        with self.cond:
+            stats = dict(self.counters)
+            stats['queued'] = len(self.pending)
+            stats['parked_files'] = len(self.parked)
+            stats['error'] = self.error
+            stats['synced'] = sum(1 for known in self.manifest.values() if known.get('sha1'))
+            stats['retry_in'] = max(0, self.retry_at - time.time()) if self.delay else 0
+            return stats
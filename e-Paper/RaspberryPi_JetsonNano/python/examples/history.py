@@ -0,0 +1,220 @@
+# history
+#
+# Every save of a document kept as a revision, so what changed since any
+# earlier save can be shown and any of them opened again. The revisions of
+# data/<file> are appended to data/history/<file>.log, one per line:
+#   <rev> <kind> <time> <json>
+# A 'delta' holds the paragraphs that changed against the revision before it,
+# as [start, end, new paragraphs] replacements. Every KEYFRAME_EVERY-th
+# revision, and any whose delta is not much smaller than the text, is a 'key'
+# holding the whole text as chunks of a snapshot.SnapshotStore, so keyframes
+# share storage with each other and with the drafts. Checking out a revision
+# reads its keyframe and at most KEYFRAME_EVERY - 1 deltas.
+#
+# The log is only appended to, one fsynced record per save. A record cut short
+# by power loss is dropped the next time the log is read.
+#
+# The latest revision of each file is kept as paragraphs along with where each
+# of them ends in the file. Each save says which paragraph is the first one it
+# changed when it is queued (saving()), and recording it reads the file back
+# only from the first paragraph changed by any save not recorded yet: saves
+# still being written, and ones that failed, whose changes are in the file
+# once a later save lands.
+
+import os
+import json
+import difflib
+import itertools
+import threading
+from array import array
+import iostats
+
+HISTORY_DIR = 'history'
+KEYFRAME_EVERY = 16
+
+
+def delta(old, new):
+    # [start, end, paragraphs] replacements turning the old paragraphs into the new
+    start = 0
+    limit = min(len(old), len(new))
+    while start < limit and old[start] == new[start]:
+        start += 1
+    end = 0
+    while end < limit - start and old[len(old) - 1 - end] == new[len(new) - 1 - end]:
+        end += 1
+    matcher = difflib.SequenceMatcher(None, old[start:len(old) - end], new[start:len(new) - end], autojunk=False)
+    return [[start + i1, start + i2, new[start + j1:start + j2]]
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal']
+
+
+def apply(old, ops):
+    new = []
+    pos = 0
+    for start, end, paragraphs in ops:
+        new.extend(old[pos:start])
+        new.extend(paragraphs)
+        pos = end
+    new.extend(old[pos:])
+    return new
+
+
+def paragraphs(data):
+    text = data.decode('utf-8', errors='replace')
+    if text.endswith('\n'):
+        text = text[:-1]
+    return text.split('\n') if text else []
+
+
+class Log:
+    # the revision records of one file, with where each starts in the log
+    def __init__(self, path):
+        self.path = path
+        self.records = []  # (offset, kind, time)
+        self.end = 0
+        try:
+            with open(path, 'rb') as file:
+                for line in file:
+                    try:
+                        rev, kind, when, _ = line.split(b' ', 3)
+                        if not line.endswith(b'\n') or int(rev) != len(self.records):
+                            break
+                        self.records.append((self.end, kind.decode(), float(when)))
+                    except ValueError:
+                        break
+                    self.end += len(line)
+        except FileNotFoundError:
+            pass
+
+    def append(self, kind, when, payload):
+        line = f"{len(self.records)} {kind} {when:.0f} {json.dumps(payload)}\n".encode('utf-8')
+        with open(self.path, 'ab') as file:
+            file.truncate(self.end)  # anything after the last good record
+            file.write(line)
+            file.flush()
+            os.fsync(file.fileno())
+        iostats.count('history', len(line), fsyncs=1)
+        self.records.append((self.end, kind, when))
+        self.end += len(line)
+        return len(self.records) - 1
+
+    def payload(self, rev):
+        with open(self.path, 'rb') as file:
+            file.seek(self.records[rev][0])
+            return json.loads(file.readline().split(b' ', 3)[3])
+
+
+class History:
+    def __init__(self, directory, store):
+        self.directory = os.path.join(directory, HISTORY_DIR)
+        self.store = store
+        self.logs = {}  # file name -> Log
+        self.heads = {}  # file name -> paragraphs of its latest revision
+        self.ends = {}  # file name -> where each of those paragraphs ends in the file
+        self.unrecorded = {}  # file name -> {save number: first paragraph it changed}
+        self.numbers = itertools.count(1)
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def log(self, name):
+        log = self.logs.get(name)
+        if log is None:
+            log = Log(os.path.join(self.directory, name + '.log'))
+            self.logs[name] = log
+        return log
+
+    def saving(self, path, first):
+        # call when a save of path is queued, with the first paragraph changed since
+        # the save queued before it (None if none was). Returns the number to
+        # record the save with.
+        with self.lock:
+            number = next(self.numbers)
+            if first is not None:
+                self.unrecorded.setdefault(os.path.basename(path), {})[number] = first
+            return number
+
+    def record(self, path, when, number=None):
+        # call after save number of path was written, without a number the whole
+        # file is read back. Returns the new revision or None if nothing changed.
+        name = os.path.basename(path)
+        with self.lock:
+            log = self.log(name)
+            rev = len(log.records)
+            head = self.heads.get(name)
+            if head is None and rev:
+                head = self.checkout_locked(name, rev - 1)
+            unrecorded = self.unrecorded.get(name, {})
+            if number is None or head is None:
+                first = 0
+            elif not unrecorded:
+                return None
+            else:
+                first = min(min(unrecorded.values()), len(head))
+            ends = self.ends.get(name)
+            if ends is None:
+                ends = self.ends[name] = array('Q')
+                offset = 0
+                for paragraph in head or []:
+                    offset += len(paragraph.encode('utf-8')) + 1
+                    ends.append(offset)
+
+            # the paragraphs before first are as they were, only the rest is read
+            start = ends[first - 1] if first else 0
+            with open(path, 'rb') as file:
+                file.seek(start)
+                rest = file.read()
+            # this save's changes and those of the saves before it are in the file now
+            for earlier in [n for n in unrecorded if number is None or n <= number]:
+                del unrecorded[earlier]
+            text = (head[:first] if first else []) + paragraphs(rest)
+            if head == text:
+                return None
+
+            ops = delta(head, text) if head is not None else None
+            if (ops is None or rev % KEYFRAME_EVERY == 0
+                    or 2 * sum(len(p) for _, _, changed in ops for p in changed) > sum(len(p) for p in text)):
+                listing, _ = self.store.store(path, 'history')
+                log.append('key', when, {'chunks': listing})
+            else:
+                log.append('delta', when, {'ops': ops})
+            self.heads[name] = text
+            del ends[first:]
+            offset = start
+            for paragraph in text[first:]:
+                offset += len(paragraph.encode('utf-8')) + 1
+                ends.append(offset)
+            return rev
+
+    def revisions(self, name):
+        # [(rev, time, kind)] oldest first
+        with self.lock:
+            return [(rev, when, kind) for rev, (_, kind, when) in enumerate(self.log(name).records)]
+
+    def checkout(self, name, rev):
+        # the paragraphs of a revision
+        with self.lock:
+            return self.checkout_locked(name, rev)
+
+    def checkout_locked(self, name, rev):
+        log = self.log(name)
+        key = rev
+        while log.records[key][1] != 'key':
+            key -= 1
+        text = paragraphs(self.store.read(log.payload(key)['chunks']))
+        for later in range(key + 1, rev + 1):
+            text = apply(text, log.payload(later)['ops'])
+        return text
+
+    def diff(self, name, rev):
+        # what changed from a revision to the latest one: [(mark, paragraph number, text)],
+        # '-' for paragraphs taken out and '+' for the ones put in
+        with self.lock:
+            latest = len(self.log(name).records) - 1
+            old = self.checkout_locked(name, rev)
+            new = self.heads.get(name) or self.checkout_locked(name, latest)
+        changes = []
+        shift = 0  # how far paragraphs after the last change moved
+        for start, end, added in delta(old, new):
+            changes.extend(('-', i + 1, old[i]) for i in range(start, end))
+            changes.extend(('+', start + shift + 1 + i, paragraph) for i, paragraph in enumerate(added))
+            shift += len(added) - (end - start)
+        return changes
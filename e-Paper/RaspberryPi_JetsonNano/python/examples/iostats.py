@@ -0,0 +1,92 @@
+# iostats
+#
+# What the editor writes to the SD card this session: bytes, fsyncs and files
+# written for each kind of write (save, autosave, snapshot, history, index...),
+# and the bytes the user actually typed, so write amplification is the one
+# divided by the other. The writers call count() themselves, in the style of
+# epdconfig.spi_stats(). sqlite (the search index) writes on its own, so the
+# kernel's count of bytes the whole process wrote, from /proc/self/io, is
+# reported next to it for comparison where there is one.
+#
+# write_log() appends the session's report so far to a log file, one json per
+# line; the last line with a given session_start has that session's totals.
+
+import json
+import time
+import threading
+
+PROC_IO = '/proc/self/io'
+
+_lock = threading.Lock()
+_kinds = {}  # kind -> {'bytes', 'fsyncs', 'files'}
+_typed = 0
+_session_start = time.time()
+
+
+def process_written():
+    # bytes the kernel has had this process write to storage, None off Linux
+    try:
+        with open(PROC_IO, 'r') as file:
+            for line in file:
+                if line.startswith('write_bytes:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+_process_start = process_written()
+
+
+def count(kind, nbytes, fsyncs=0, files=1):
+    with _lock:
+        counters = _kinds.setdefault(kind, {'bytes': 0, 'fsyncs': 0, 'files': 0})
+        counters['bytes'] += nbytes
+        counters['fsyncs'] += fsyncs
+        counters['files'] += files
+
+
+def typed(nbytes):
+    global _typed
+    with _lock:
+        _typed += nbytes
+
+
+def io_stats():
+    with _lock:
+        kinds = {kind: dict(counters) for kind, counters in _kinds.items()}
+        typed_bytes = _typed
+    written = sum(counters['bytes'] for counters in kinds.values())
+    stats = {
+        'session_start': _session_start,
+        'seconds': time.time() - _session_start,
+        'kinds': kinds,
+        'bytes': written,
+        'fsyncs': sum(counters['fsyncs'] for counters in kinds.values()),
+        'files': sum(counters['files'] for counters in kinds.values()),
+        'typed': typed_bytes,
+        'amplification': written / typed_bytes if typed_bytes else None,
+        'process_bytes': None,
+    }
+    process = process_written()
+    if process is not None and _process_start is not None:
+        stats['process_bytes'] = process - _process_start
+    return stats
+
+
+def reset_io_stats():
+    global _typed, _session_start, _process_start
+    with _lock:
+        _kinds.clear()
+        _typed = 0
+        _session_start = time.time()
+        _process_start = process_written()
+
+
+def write_log(path):
+    # append this session's numbers to path, not counted itself
+    try:
+        with open(path, 'a') as file:
+            file.write(json.dumps(io_stats()) + '\n')
+    except OSError:
+        pass
@@ -0,0 +1,111 @@
+# lineindex
+#
+# Random access to the lines of a text file without reading it into Python
+# strings. The file is mmap'd read only and the byte offset of each line start
+# is kept in an array, saved next to the file as <file>.idx so the next open
+# only has to read the offsets.
+#
+# The saved index records how many bytes it covers and a crc of the last block
+# of them. If the file still has those bytes, only the bytes after them are
+# scanned; otherwise the index is rebuilt from scratch. The crc only looks at
+# the end of what is covered, so whoever rewrites the file from some line on
+# must first cut the index back to the lines before it with keep(); the
+# editor's Document does this as soon as a loaded paragraph is edited.
+
+import os
+import mmap
+import struct
+import zlib
+import iostats
+from array import array
+
+MAGIC = b'ZWL1'
+HEADER = struct.Struct('<4sQI')  # magic, bytes covered, crc32 of the last CHECK_BYTES of them
+CHECK_BYTES = 4096
+
+
+class LineIndex:
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        if self.size:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.map = b''  # mmap can't map an empty file
+        self.starts = array('Q')  # offset of each complete line
+        self.end = 0  # bytes covered by starts, a line after it has no newline yet
+
+        if not self.load_index():
+            self.starts = array('Q')
+            self.end = 0
+        if self.scan():
+            self.save_index()
+        self.kept = len(self.starts)  # lines the saved index covers
+
+    def check(self, end):
+        return zlib.crc32(self.map[max(0, end - CHECK_BYTES):end])
+
+    def load_index(self):
+        try:
+            with open(self.index_path, 'rb') as file:
+                magic, end, crc = HEADER.unpack(file.read(HEADER.size))
+                if (magic != MAGIC or end > self.size or self.check(end) != crc
+                        or (end and self.map[end - 1] != ord('\n'))):
+                    return False
+                count = (os.fstat(file.fileno()).st_size - HEADER.size) // self.starts.itemsize
+                self.starts.fromfile(file, count)
+                self.end = end
+                return True
+        except (OSError, EOFError, struct.error):
+            return False
+
+    def save_index(self, count=None):
+        # save the offsets of the first count lines (all of them by default)
+        starts, end = self.starts, self.end
+        if count is not None and count < len(self.starts):
+            starts, end = self.starts[:count], self.starts[count]
+        try:
+            with open(self.index_path, 'wb') as file:
+                file.write(HEADER.pack(MAGIC, end, self.check(end)))
+                starts.tofile(file)
+                iostats.count('index', file.tell())
+        except OSError:
+            pass  # read only storage, the index is rebuilt next time
+
+    def keep(self, count):
+        # the file is about to be rewritten from line count on, the saved index
+        # must not vouch for anything after it
+        if count < self.kept:
+            self.kept = count
+            self.save_index(count)
+
+    def scan(self):
+        # index lines completed after self.end, returns True if any were found
+        pos = self.end
+        while True:
+            newline = self.map.find(b'\n', pos)
+            if newline < 0:
+                break
+            self.starts.append(pos)
+            pos = newline + 1
+        found = pos != self.end
+        self.end = pos
+        return found
+
+    def __len__(self):
+        return len(self.starts) + (1 if self.end < self.size else 0)
+
+    def line(self, index):
+        if index < len(self.starts):
+            start = self.starts[index]
+            stop = self.starts[index + 1] - 1 if index + 1 < len(self.starts) else self.end - 1
+        else:
+            start, stop = self.end, self.size
+        return self.map[start:stop].rstrip(b'\r').decode('utf-8', errors='replace')
+
+    def close(self):
+        if self.size:
+            self.map.close()
+        self.file.close()
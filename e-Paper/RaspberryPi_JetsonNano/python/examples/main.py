@@ -17,11 +17,25 @@
 import time
 import keyboard
 import keymaps
+import wordwrap
+import pagecache
+import archive
+import search
+import snapshot
+import history
+import workspace
+import saver
+import iostats
+import autosave
+import export
+import google_drive
 from PIL import Image, ImageDraw, ImageFont
 import new4in26part
+import epdconfig
 import textwrap
 import subprocess
 import signal
+import threading
 import os
 from pathlib import Path
 
@@ -29,6 +43,19 @@ from pathlib import Path
 # Initialize the e-Paper display
 # clear refreshes whole screen, should be done on slow init()
 epd = new4in26part.EPD()
+
+#use the SPI clock found by calibrate_spi.py, if it has been run
+spi_speed_path = os.path.join(os.path.dirname(__file__), 'spi_speed.conf')
+try:
+    with open(spi_speed_path, 'r') as file:
+        epdconfig.set_spi_speed(int(file.read().strip()))
+except (FileNotFoundError, ValueError):
+    pass
+
+#which board and SPI transport push the frames, a Jetson without spidev falls back to a slow one
+spi = epdconfig.spi_stats()
+print(f"SPI: {spi['platform']} over {spi['transport']}")
+
 epd.init()
 epd.Clear()
 
@@ -39,6 +66,7 @@ display_draw = ImageDraw.Draw(display_image)
 #Display settings like font size, spacing, etc.
 display_start_line = 0
 font24 = ImageFont.truetype('Courier Prime.ttf', 32)  # Bigger font for 4.26"
+font_status = ImageFont.truetype('Courier Prime.ttf', 14)  # two lines of counts fit in the console area
 textWidth=16
 linespacing = 38  # More space between lines
 chars_per_line = 40  # Slightly reduced to prevent spillover
@@ -59,8 +87,13 @@ console_message = ""
 scrollindex=1
 
 
-# Initialize cursor position
-cursor_position = 0
+# Initialize cursor position: a paragraph of the document and the offset in it
+cursor_para = 0
+cursor_pos = 0
+
+#what each screen row shows now (12 rows of text, then the input row), so only
+#rows that changed are drawn and pushed
+drawn_rows = [None] * 13
 
 # Initialize text matrix (size of text file)
 max_lines = 100  # Maximum number of lines, adjust as needed
@@ -68,58 +101,624 @@ max_chars_per_line = chars_per_line  # Maximum characters per line, adjust as ne
 text_content=""
 temp_content=""
 input_content=""
-previous_lines = []
 typing_last_time = time.time()  # Timestamp of last key press
 
-#file directory setup: "/data/cache.txt"
-file_path = os.path.join(os.path.dirname(__file__), 'data', 'cache.txt')
+#word wrap measured in pixels against the panel width (10px margin on each side)
+wrap = wordwrap.WordWrap(font24, epd.width - 20)
+COUNT_BUDGET = 50  # paragraphs laid out per idle tick to count a loaded document's lines
+
+#word/char counts and wpm are kept up to date from the edits
+status_text = None  # what the status area shows now
+last_status_update = time.time()
+STATUS_INTERVAL = 5  # seconds between status-only refreshes while idle
+
+#edits that ctrl+z / ctrl+y can take back and redo, capped at this many bytes
+undo_memory = 256 * 1024
+
+#saves are written to a temp file and renamed in on a background thread
+saves = saver.Saver()
+
+#what the app writes to the card, per kind and against what was typed, for ctrl+i
+io_log_path = os.path.join(os.path.dirname(__file__), 'data', 'io.log')
+
+#the current document is also saved after a pause in typing, or after enough of it
+autosaves = autosave.Autosave(time.time())
+
+#open documents (ctrl+n, ctrl+tab, ctrl+q), each with its own file in /data.
+#resident ones beyond this many bytes are saved and dropped until used again.
+workspace_memory = 4 * 1024 * 1024
+docs = workspace.Workspace(os.path.join(os.path.dirname(__file__), 'data'), wrap, undo_memory, saves, workspace_memory)
+
+#the current document: the text is kept as paragraphs and wrapped for the screen as
+#it is shown. the cursor can be anywhere in it, the last display line is the input line.
+current = docs.resident(docs.current(), time.time())
+doc = current.doc
+undo_log = current.undo
+writing_stats = current.stats
+cursor_para = doc.count() - 1
+cursor_pos = len(doc.paragraph(cursor_para))
+
+#file directory setup: "/data/cache.txt" for the first document
+file_path = current.path
+
+#saved drafts are snapshots sharing their unchanged chunks, in /data/chunks and /data/snapshots
+snapshots = snapshot.SnapshotStore(os.path.join(os.path.dirname(__file__), 'data'))
 
-def load_previous_lines(file_path):
+#every save of a document as a revision, for ctrl+h
+doc_history = history.History(os.path.join(os.path.dirname(__file__), 'data'), snapshots)
+
+#metadata of the drafts (snapshots and zw_*.txt files in /data), for the file browser
+archives = archive.ArchiveIndex(os.path.join(os.path.dirname(__file__), 'data'), snapshots)
+archive_rows = 10  # drafts per browser screen
+
+#drafts exported as Markdown, HTML or EPUB to /data/exports, streamed on a worker thread
+exports = export.Exporter()
+export_dir = os.path.join(os.path.dirname(__file__), 'data', 'exports')
+
+#with a service account key at drive_credentials, ctrl+s also uploads the documents that
+#changed since the last sync to Google Drive, queued on the card while offline
+drive_credentials = os.environ.get('DRIVE_CREDENTIALS', os.path.join(os.path.dirname(__file__), 'credentials.json'))
+drive_sync = None
+if os.path.exists(drive_credentials):
+    drive_sync = google_drive.DriveSync(os.path.join(os.path.dirname(__file__), 'data'),
+                                        google_drive.DriveClient(drive_credentials))
+
+#word index of everything in /data, for ctrl+f
+search_index = search.SearchIndex(os.path.join(os.path.dirname(__file__), 'data'), snapshots)
+
+def load_document(file_path):
     try:
-        with open(file_path, 'r') as file:
-            print(file_path)
-            lines = file.readlines()
-            return [line.strip() for line in lines]
+        doc.load(file_path)
+        print(file_path)
     except FileNotFoundError:
         print("error")
-        return []
+    reset_stats()
+
+def reset_stats():
+    #counted once per document, the edits keep it up to date after that
+    writing_stats.reset(*doc.totals(), time.time())
+
+def status_lines(now):
+    #counts, with the progress of a running export in place of the second line
+    lines = writing_stats.status(now)
+    progress = exports.progress()
+    if progress is not None:
+        fmt, percent = progress
+        lines = (lines[0], f"{export.FORMATS[fmt]} {percent}%")
+    return lines
+
+def draw_status():
+    #counts in the console area, unless the input line reaches into it
+    global status_text
+
+    if wrap.width(input_content + "|") + 10 >= 650:
+        status_text = None
+        return
+    status_text = status_lines(time.time())
+    display_draw.rectangle((650, 440, 800, 480), fill=255)
+    display_draw.text((650, 442), status_text[0], font=font_status, fill=0)
+    display_draw.text((650, 460), status_text[1], font=font_status, fill=0)
+
+def update_status():
+    #only the status corner changed, push just that where the driver can
+    global last_status_update
+
+    draw_status()
+    partial_buffer = epd.getbuffer(display_image)
+    if hasattr(epd, 'display_Partial'):
+        epd.display_Partial(partial_buffer, 648, 440, epd.width, epd.height)
+    else:
+        epd.display(partial_buffer)
+    last_status_update = time.time()
     
-def save_previous_lines(file_path, lines):
+def save_document(file_path, done=None, kind='save'):
+    #queued for the writer thread, the document is copied as it is now
     print("attempting save")
-    with open(file_path, 'w') as file:
-        for line in lines:
-            file.write(line + '\n')
+    if file_path == docs.current().path:
+        autosaves.saved(time.time())
+    #the history reads the file back from the first paragraph this save or an
+    #unrecorded earlier one changed
+    number = doc_history.saving(file_path, doc.take_changed())
+    def saved(path):
+        search_index.update(path)
+        doc_history.record(path, time.time(), number)
+        if done is not None:
+            done(path)
+    saves.save(file_path, doc.snapshot(), saved, kind)
+
+def archive_document():
+    #save the document and snapshot it as zw_YYYYMMDDHHMMSS.txt, only chunks that
+    #changed since the last snapshot take up space
+    timestamp = time.strftime("%Y%m%d%H%M%S")  # Format: YYYYMMDDHHMMSS
+    name = f'zw_{timestamp}.txt'
+    def snapshotted(path):
+        snapshots.add(name, path)
+        archives.update(path, name)
+        search_index.update(path, name)
+        if drive_sync is not None:
+            drive_sync.sync()
+    save_document(file_path, snapshotted)
+
+def export_draft(name, fmt):
+    #stream a draft to /data/exports/<name>.<fmt> in the background, typing goes on meanwhile
+    os.makedirs(export_dir, exist_ok=True)
+    if snapshots.has(name):
+        lines = export.chunk_lines(snapshots, name)
+        total = snapshots.manifest(name)['size']
+    else:
+        path = archives.path(name)
+        lines = export.file_lines(path)
+        total = os.path.getsize(path)
+    stem = os.path.splitext(name)[0]
+    exports.export(fmt, stem, lines, total, os.path.join(export_dir, f"{stem}.{fmt}"))
+
+def read_key_down():
+    event = keyboard.read_event()
+    while event.event_type != keyboard.KEY_DOWN:
+        event = keyboard.read_event()
+    return event.name
+
+def browse_archives():
+    #pick a saved draft, newest first. Only the index is read, never the drafts.
+    saves.flush()
+    archives.refresh()
+    listing = archives.listing()
+    if not listing:
+        return None
+
+    selected_index = 0
+    while True:
+        page = selected_index // archive_rows
+        pages = (len(listing) + archive_rows - 1) // archive_rows
+
+        display_draw.rectangle((0, 0, 800, 480), fill=255)
+        display_draw.text((10, 10), f"Drafts {page + 1}/{pages} (arrows to select):", font=font24, fill=0)
+
+        y = 60
+        for i in range(page * archive_rows, min(len(listing), (page + 1) * archive_rows)):
+            name, info = listing[i]
+            arrow = ">" if i == selected_index else " "
+            display_draw.text((10, y), f"{arrow} {(info['first_line'] or name)[:28]}", font=font24, fill=0)
+            display_draw.text((620, y), f"{info['words']}w", font=font24, fill=0)
+            y += linespacing
+
+        display_draw.text((10, 450), "Enter | E=txt M=md H=html B=epub | Esc", font=font24, fill=0)
+
+        partial_buffer = epd.getbuffer(display_image)
+        epd.display(partial_buffer)
+
+        # Wait for key
+        key = read_key_down()
+
+        if key == "up":
+            selected_index = max(0, selected_index - 1)
+        elif key == "down":
+            selected_index = min(len(listing) - 1, selected_index + 1)
+        elif key == "left":
+            selected_index = max(0, selected_index - archive_rows)
+        elif key == "right":
+            selected_index = min(len(listing) - 1, selected_index + archive_rows)
+        elif key == "enter":
+            return listing[selected_index][0]
+        elif key == "e" and snapshots.has(listing[selected_index][0]):
+            #a plain text copy in /data, to take off the card
+            snapshots.export(listing[selected_index][0])
+        elif key in ("m", "h", "b"):
+            export_draft(listing[selected_index][0], {"m": "md", "h": "html", "b": "epub"}[key])
+        elif key == "esc":
+            return None
+
+def search_archives():
+    #type a phrase, pick one of the drafts that has it
+    query = ""
+    while True:
+        display_draw.rectangle((0, 0, 800, 480), fill=255)
+        display_draw.text((10, 10), "Find:", font=font24, fill=0)
+        display_draw.text((10, 60), query + "_", font=font24, fill=0)
+        display_draw.text((10, 450), "Enter=Search | Esc=Cancel", font=font24, fill=0)
+        partial_buffer = epd.getbuffer(display_image)
+        epd.display(partial_buffer)
+
+        key = read_key_down()
+        if key == "enter":
+            break
+        elif key == "esc":
+            return None
+        elif key == "backspace":
+            query = query[:-1]
+        elif key == "space":
+            query += " "
+        elif len(key) == 1:
+            query += key
+
+    saves.flush()
+    search_index.refresh()
+    results = search_index.search(query)
+
+    selected_index = 0
+    while True:
+        display_draw.rectangle((0, 0, 800, 480), fill=255)
+        display_draw.text((10, 10), f"{len(results)} found: {query}"[:40], font=font24, fill=0)
+
+        y = 60
+        for i, (name, snippet) in enumerate(results):
+            arrow = ">" if i == selected_index else " "
+            display_draw.text((10, y), f"{arrow} {snippet}", font=font24, fill=0)
+            y += linespacing
+
+        display_draw.text((10, 450), "Enter=Open | Esc=Cancel", font=font24, fill=0)
+        partial_buffer = epd.getbuffer(display_image)
+        epd.display(partial_buffer)
+
+        key = read_key_down()
+        if key == "up":
+            selected_index = max(0, selected_index - 1)
+        elif key == "down":
+            selected_index = min(len(results) - 1, selected_index + 1)
+        elif key == "enter" and results:
+            return results[selected_index][0]
+        elif key == "esc":
+            return None
+
+def browse_history():
+    #pick an earlier save of this document. What changed since is worked out in the
+    #background while the list is up; Enter shows it, O opens that revision.
+    name = os.path.basename(file_path)
+    save_document(file_path)
+    saves.flush()
+    listing = doc_history.revisions(name)[::-1]
+    if not listing:
+        return None
+
+    changes = {}  # rev -> (event set once worked out, [changes since])
+    def compare(rev):
+        if rev not in changes:
+            done, result = threading.Event(), []
+            changes[rev] = (done, result)
+            def work():
+                try:
+                    result.extend(doc_history.diff(name, rev))
+                finally:
+                    done.set()
+            threading.Thread(target=work, daemon=True).start()
+
+    selected_index = 0
+    while True:
+        compare(listing[selected_index][0])
+        page = selected_index // archive_rows
+        pages = (len(listing) + archive_rows - 1) // archive_rows
+
+        display_draw.rectangle((0, 0, 800, 480), fill=255)
+        display_draw.text((10, 10), f"History {page + 1}/{pages} (arrows to select):", font=font24, fill=0)
+
+        y = 60
+        for i in range(page * archive_rows, min(len(listing), (page + 1) * archive_rows)):
+            rev, when, kind = listing[i]
+            arrow = ">" if i == selected_index else " "
+            saved_at = time.strftime("%m-%d %H:%M:%S", time.localtime(when))
+            display_draw.text((10, y), f"{arrow} r{rev} {saved_at}{' *' if kind == 'key' else ''}", font=font24, fill=0)
+            y += linespacing
+
+        display_draw.text((10, 450), "Enter=Changes | O=Open | Esc=Cancel", font=font24, fill=0)
+
+        partial_buffer = epd.getbuffer(display_image)
+        epd.display(partial_buffer)
+
+        key = read_key_down()
+
+        if key == "up":
+            selected_index = max(0, selected_index - 1)
+        elif key == "down":
+            selected_index = min(len(listing) - 1, selected_index + 1)
+        elif key == "left":
+            selected_index = max(0, selected_index - archive_rows)
+        elif key == "right":
+            selected_index = min(len(listing) - 1, selected_index + archive_rows)
+        elif key == "enter":
+            show_changes(listing[selected_index][0], *changes[listing[selected_index][0]])
+        elif key == "o":
+            return listing[selected_index][0]
+        elif key == "esc":
+            return None
+
+def show_changes(rev, done, changes):
+    #the paragraphs taken out (-) and put in (+) since a revision, a screen at a time,
+    #once the comparison set done
+    if not done.is_set():
+        display_draw.rectangle((0, 0, 800, 480), fill=255)
+        display_draw.text((10, 10), f"Comparing with r{rev}...", font=font24, fill=0)
+        epd.display(epd.getbuffer(display_image))
+        done.wait()
+
+    lines = []
+    for mark, number, text in changes:
+        text = f"{mark}{number} {text}"
+        lines.extend(wrap.lines(text, wrap.breaks(text)))
+    if not lines:
+        lines = ["No changes."]
+
+    top = 0
+    while True:
+        display_draw.rectangle((0, 0, 800, 480), fill=255)
+        display_draw.text((10, 10), f"Since r{rev}: {len(changes)} paragraphs", font=font24, fill=0)
+        y = 60
+        for line in lines[top:top + archive_rows]:
+            display_draw.text((10, y), line, font=font24, fill=0)
+            y += linespacing
+        display_draw.text((10, 450), "Arrows=Scroll | Esc=Back", font=font24, fill=0)
+        epd.display(epd.getbuffer(display_image))
+
+        key = read_key_down()
+        if key in ("down", "right"):
+            top = min(max(0, len(lines) - archive_rows), top + archive_rows)
+        elif key in ("up", "left"):
+            top = max(0, top - archive_rows)
+        elif key in ("esc", "enter"):
+            return
+
+def show_stats():
+    #what was written to the card this session, also appended to /data/io.log
+    io = iostats.io_stats()
+    saved = saves.stats()
+    iostats.write_log(io_log_path)
+
+    totals = [f"{'total':<9}{io['files']:>5}f{io['bytes'] / 1024:>8.1f}K{io['fsyncs']:>5}s"]
+    amplification = f"x{io['amplification']:.0f}" if io['amplification'] is not None else "-"
+    totals.append(f"typed {io['typed'] / 1024:.1f}K, written {amplification}")
+    if io['process_bytes'] is not None:
+        totals.append(f"process wrote {io['process_bytes'] / 1024:.1f}K")
+    totals.append(f"save {saved['latency'] * 1000:.0f}ms, max {saved['max_latency'] * 1000:.0f}ms, queue {saved['max_queued']}")
+    spi = epdconfig.spi_stats()
+    totals.append(f"spi {spi['transport']}, {spi['bytes'] / 1024:.0f}K in {spi['seconds']:.1f}s")
+    if drive_sync is not None:
+        synced = drive_sync.stats()
+        if synced['error'] is not None:
+            totals.append("drive stopped: " + synced['error'][:25])
+        else:
+            totals.append(f"drive {synced['queued']} queued, {synced['parked_files']} parked")
+
+    #the kinds that wrote the most, as many as fit above the totals
+    lines = []
+    for kind, counters in sorted(io['kinds'].items(), key=lambda item: -item[1]['bytes']):
+        lines.append(f"{kind[:9]:<9}{counters['files']:>5}f{counters['bytes'] / 1024:>8.1f}K{counters['fsyncs']:>5}s")
+    lines = lines[:archive_rows - len(totals)] + totals
+
+    display_draw.rectangle((0, 0, 800, 480), fill=255)
+    display_draw.text((10, 10), f"Writes, last {io['seconds'] / 60:.0f} min:", font=font24, fill=0)
+    y = 60
+    for line in lines[:archive_rows]:
+        display_draw.text((10, y), line, font=font24, fill=0)
+        y += linespacing
+    display_draw.text((10, 450), "Any key=Back", font=font24, fill=0)
+    epd.display(epd.getbuffer(display_image))
+    read_key_down()
+
+def open_revision(rev):
+    #an earlier revision becomes the document. The text it replaces is the latest
+    #revision already, browse_history saved it.
+    text = doc_history.checkout(os.path.basename(file_path), rev)
+    data = "".join(paragraph + '\n' for paragraph in text).encode('utf-8')
+    saves.flush()
+    doc.clear()  # unmaps the file before it is replaced
+    undo_log.clear()
+    saves.save(file_path, lambda file: file.write(data), search_index.update)
+    saves.flush()
+    load_document(file_path)
+    cursor_to_end()
+
+def open_archive(name):
+    #the draft becomes the document being edited, the current one is archived first
+    if doc.count() > 1 or doc.input_line():
+        archive_document()
+    saves.flush()  # nothing queued may land on file_path after the copy
+    doc.clear()  # unmaps cache.txt before it is replaced
+    undo_log.clear()
+    archives.restore(name, file_path)
+    try:
+        os.remove(file_path + '.idx')
+    except FileNotFoundError:
+        pass
+    load_document(file_path)
+    cursor_to_end()
+
+def cursor_to_end():
+    global cursor_para
+    global cursor_pos
+
+    cursor_para = doc.count() - 1
+    cursor_pos = len(doc.paragraph(cursor_para))
+
+def use_document(entry):
+    #point the editor at the workspace's current document. Its last frame is pushed
+    #straight back if nothing changed since, otherwise it is drawn again.
+    global doc
+    global undo_log
+    global writing_stats
+    global file_path
+    global scrollindex
+    global input_content
+    global cursor_para
+    global cursor_pos
+    global drawn_rows
+    global needs_display_update
+    global needs_input_update
+
+    doc = entry.doc
+    undo_log = entry.undo
+    writing_stats = entry.stats
+    file_path = entry.path
+    scrollindex = entry.scroll
+    input_content = doc.input_line()
+    if entry.cursor is not None and entry.cursor[0] < doc.count():
+        cursor_para = entry.cursor[0]
+        cursor_pos = min(entry.cursor[1], len(doc.paragraph(cursor_para)))
+    else:
+        cursor_to_end()
+
+    if entry.frame is not None and entry.frame[0] == doc.version:
+        display_image.paste(entry.frame[1])
+        epd.display(entry.frame[2])
+        drawn_rows = list(entry.frame[3])
+    else:
+        needs_display_update = True
+        needs_input_update = True
+
+def leave_document():
+    #save the current document and keep what is on screen for switching back
+    save_document(file_path)
+    entry = docs.current()
+    entry.frame = (doc.version, display_image.copy(), bytes(epd.getbuffer(display_image)), list(drawn_rows))
+    entry.scroll = scrollindex
+    entry.cursor = (cursor_para, cursor_pos)
+
+def page_count():
+    #screens of text above the input line, None until the idle loop has counted them
+    lines = doc.known_line_count()
+    if lines is None:
+        return None
+    return round((lines - 1)/lines_on_screen)
+
+def max_scroll(scroll):
+    #the furthest back scroll can go, looking only a screen past it
+    return round((doc.line_count((scroll + 1) * lines_on_screen + 2) - 1)/lines_on_screen+1)
+
+def row_y(row):
+    #where the text of a screen row is drawn, row 12 is the input line
+    return 440 - linespacing * (lines_on_screen - row)
+
+def row_band(row):
+    #the pixel rows that belong to a screen row: its text reaches a little above
+    #row_y and well short of the next row, the input row runs to the bottom
+    top = max(row_y(row) - 4, 0)
+    if row == lines_on_screen:
+        return top, epd.height
+    return top, row_y(row) - 4 + linespacing
+
+def draw_row(draw, row, content):
+    top, bottom = row_band(row)
+    draw.rectangle((0, top, epd.width, bottom), fill=255)
+    x, text = content
+    draw.text((x, row_y(row)), text, font=font24, fill=0)
+
+def page_rows(lines):
+    #the text rows of a screen from doc.page_lines, blank at the top if there are fewer
+    return [(10, "")] * (lines_on_screen - len(lines)) + [(10, text) for _, _, text in lines]
+
+def page_marker(scroll):
+    count = page_count()
+    if count is None:
+        return (650, f'[-{scroll - 1}]')
+    return (650, f'[{count-scroll+1}/{count}]')
+
+def with_cursor(text, col):
+    return (10, text[:col] + "|" + text[col:])
+
+def screen_rows():
+    #what every row should show now: the page we are scrolled to with the cursor
+    #in it, and the input line below (or the page marker while scrolled back)
+    lines = doc.page_lines(scrollindex, lines_on_screen)
+    rows = page_rows(lines)
+    line = doc.line_at(cursor_para, cursor_pos)
+    col = cursor_pos - doc.breaks(cursor_para)[line]
+    first = lines_on_screen - len(lines)
+    for i, (para, para_line, text) in enumerate(lines):
+        if para == cursor_para and para_line == line:
+            rows[first + i] = with_cursor(text, col)
+
+    if scrollindex == 1:
+        last = doc.count() - 1
+        if cursor_para == last and line == len(doc.breaks(last)) - 1:
+            rows.append(with_cursor(input_content, col))
+        else:
+            rows.append((10, input_content))
+    else:
+        rows.append(page_marker(scrollindex))
+    return rows
+
+def render_page(version, scroll):
+    #a scrolled-to screen with its page marker, drawn off screen for the page cache.
+    #None if the document moved on from that version (or was switched) meanwhile.
+    #The cursor is drawn in afterwards, it isn't part of the version.
+    if doc.version != version:
+        return None
+    image = Image.new('1', (epd.width, epd.height), 255)
+    draw = ImageDraw.Draw(image)
+    rows = page_rows(doc.page_lines(scroll, lines_on_screen)) + [page_marker(scroll)]
+    for row, content in enumerate(rows):
+        draw_row(draw, row, content)
+    if doc.version != version:
+        return None
+    return image, epd.getbuffer(image), rows
+
+#rendered scroll pages, keyed by document version so typing never shows a stale one
+pages = pagecache.PageCache(render_page)
+
+def show_page():
+    #a page flip is just pushing the cached frame, the pages either side are then
+    #rendered in the background while the user reads
+    global needs_input_update
+    global drawn_rows
+
+    page = None
+    while page is None:
+        version = doc.version
+        page = pages.get(version, scrollindex)
+    image, buffer, rows = page
+    display_image.paste(image)
+    epd.display(buffer)
+    drawn_rows = list(rows)
+    pages.prefetch(version, [s for s in (scrollindex - 1, scrollindex + 1) if 1 <= s <= max_scroll(scrollindex)])
+
+    #the cursor, and the input line on the newest page, go in as a row update
+    needs_input_update = True
+
+def cursor_behind():
+    #display lines after the cursor's one, 0 when it is on the input line
+    return doc.lines_after(cursor_para, doc.line_at(cursor_para, cursor_pos))
+
+def cursor_on_screen():
+    behind = cursor_behind()
+    if behind == 0:
+        return scrollindex == 1
+    #the lines above the input line, as many as it takes to tell if this is the top screen
+    above = doc.line_count(scrollindex * lines_on_screen + 1) - 1
+    start = max(0, above - scrollindex * lines_on_screen)
+    return start <= above - behind < start + lines_on_screen
+
+def follow_cursor():
+    #scroll so the cursor's line is on screen
+    global scrollindex
+
+    if not cursor_on_screen():
+        scrollindex = max(1, (cursor_behind() + lines_on_screen - 1) // lines_on_screen)
 
 def update_display():
     global last_display_update
     global needs_display_update
     global cursor_index
-    global previous_lines
     global display_updating
     global updating_input_area
     global console_message
     global current_line
     global scrollindex
+    global drawn_rows
     
     # Clear the main display area -- also clears input line (270-300)
     display_draw.rectangle((0, 0, 800, 480), fill=255)
     
-    # Display the previous lines
-    y_position = 440 - linespacing  # leaves room for cursor input
-
-    #Make a temp array from previous_lines. And then reverse it and display as usual.
-    current_line=max(0,len(previous_lines)-lines_on_screen*scrollindex)
-    temp=previous_lines[current_line:current_line+lines_on_screen]
-
-    for line in reversed(temp[-lines_on_screen:]):
-       display_draw.text((10, y_position), line[:chars_per_line], font=font24, fill=0)
-       y_position -= linespacing
+    rows = screen_rows()
+    for row, content in enumerate(rows):
+        draw_row(display_draw, row, content)
+    drawn_rows = rows
 
     #Display Console Message
     if console_message != "":
         display_draw.rectangle((650, 440, 800, 480), fill=255)
         display_draw.text((650, 440), console_message, font=font24, fill=0)
         console_message = ""
+        drawn_rows[lines_on_screen] = None
+    elif scrollindex == 1:
+        draw_status()
     
     #generate display buffer for display
     partial_buffer = epd.getbuffer(display_image)
@@ -130,55 +729,174 @@ def update_display():
     display_updating= False
     needs_display_update = False
 
-def update_input_area(): #this updates the input area of the typewriter (active line)
+def update_input_area(): #this updates the rows that changed, usually just the input line
     global last_display_update
     global needs_display_update
-    global cursor_index
     global needs_input_update
     global updating_input_area
+    global drawn_rows
 
-    cursor_index = cursor_position
-    display_draw.rectangle((0, 440, 800, 480), fill=255)  # Clear input area
-    
-    #add cursor
-    temp_content = input_content[:cursor_index] + "|" + input_content[cursor_index:]
-    
-    #draw input line text
-    display_draw.text((10, 440), str(temp_content[:chars_per_line]), font=font24, fill=0)
+    rows = screen_rows()
+    changed = [row for row in range(len(rows)) if rows[row] != drawn_rows[row]]
+    if (scrollindex == 1 and lines_on_screen not in changed and status_text is not None
+            and status_lines(time.time()) != status_text):
+        #an edit further up still changes the counts in the corner
+        changed.append(lines_on_screen)
+    if not changed:
+        return
+
+    for row in changed:
+        draw_row(display_draw, row, rows[row])
+    if lines_on_screen in changed and scrollindex == 1:
+        draw_status()
+    drawn_rows = rows
     
-    #generate display buffer for input line
+    #generate display buffer for the changed rows
     updating_input_area = True
     partial_buffer = epd.getbuffer(display_image)
-    epd.display(partial_buffer)
+    if hasattr(epd, 'display_Partial'):
+        #drivers with a windowed partial refresh only push the band of changed rows
+        epd.display_Partial(partial_buffer, 0, row_band(changed[0])[0], epd.width, row_band(changed[-1])[1])
+    else:
+        epd.display(partial_buffer)
     updating_input_area = False
-    
-def insert_character(character):
-    global cursor_position
-    global input_content
-    global needs_display_update
-    
-    cursor_index = cursor_position
-    
-    if cursor_index <= len(input_content):
-        # Insert character in the text_content string
-        input_content = input_content[:cursor_index] + character + input_content[cursor_index:]
-        cursor_position += 1  # Move the cursor forward
-    
+
+def move_cursor(para, pos):
+    global cursor_para
+    global cursor_pos
+    global needs_input_update
+
+    cursor_para = para
+    cursor_pos = pos
+    follow_cursor()
     needs_input_update = True
 
-def delete_character():
-    global cursor_position
+def apply_edit(kind, para, pos, removed, inserted):
+    #carry out one change to the document (see undo.py for the kinds) and re-wrap
+    #only the lines it touched. update_input_area then redraws the rows that moved.
     global input_content
-    global needs_display_update
-    
-    cursor_index = cursor_position
-    
-    if cursor_index > 0:
-        # Remove the character at the cursor position
-        input_content = input_content[:cursor_index - 1] + input_content[cursor_index:]
-        cursor_position -= 1  # Move the cursor back
-        needs_input_update = True
 
+    now = time.time()
+    text = doc.paragraph(para)
+    if kind == 'edit':
+        writing_stats.edit(text, pos, len(removed), inserted, now)
+        doc.edit(para, pos, len(removed), inserted)
+        para, pos = para, pos + len(inserted)
+    elif kind == 'split':
+        writing_stats.split(text, pos, now)
+        doc.split(para, pos)
+        para, pos = para + 1, 0
+    elif kind == 'join':
+        before = doc.paragraph(para - 1)
+        writing_stats.join(before + text, len(before), now)
+        para, pos = para - 1, doc.join(para)
+    autosaves.edit(max(1, len(removed) + len(inserted)), now)
+    input_content = doc.input_line()
+    move_cursor(para, pos)
+
+def edit_paragraph(para, pos, removed, inserted):
+    #replace removed chars at pos in a paragraph with inserted
+    removed_text = doc.paragraph(para)[pos:pos + removed]
+    undo_log.record('edit', para, pos, removed_text, inserted, time.time())
+    apply_edit('edit', para, pos, removed_text, inserted)
+
+def commit_paragraph():
+    #enter: the paragraph is broken at the cursor, the rest starts a new one
+    undo_log.record('split', cursor_para, cursor_pos, "", "", time.time())
+    apply_edit('split', cursor_para, cursor_pos, "", "")
+    iostats.typed(1)
+
+def insert_character(character):
+    edit_paragraph(cursor_para, cursor_pos, 0, character)
+    iostats.typed(len(character.encode('utf-8')))
+
+def delete_character():
+    if cursor_pos > 0:
+        # Remove the character before the cursor, this can pull text back from the line above
+        edit_paragraph(cursor_para, cursor_pos - 1, 1, "")
+    elif cursor_para > 0:
+        # at the start of a paragraph, join it onto the one before
+        pos = len(doc.paragraph(cursor_para - 1))
+        undo_log.record('join', cursor_para, pos, "", "", time.time())
+        apply_edit('join', cursor_para, pos, "", "")
+
+def undo_edit():
+    op = undo_log.undo()
+    if op is None:
+        return
+    kind, para, pos, removed, inserted = op[:5]
+    if kind == 'edit':
+        apply_edit('edit', para, pos, inserted, removed)
+    elif kind == 'split':
+        apply_edit('join', para + 1, pos, "", "")
+    elif kind == 'join':
+        apply_edit('split', para - 1, pos, "", "")
+
+def redo_edit():
+    op = undo_log.redo()
+    if op is not None:
+        apply_edit(*op[:5])
+
+def line_end(para, line):
+    #last place on a display line the cursor can go; before a wrapped line's
+    #last char, since the offset after it is the next line's start
+    breaks = doc.breaks(para)
+    if line == len(breaks) - 1:
+        return len(doc.paragraph(para))
+    return breaks[line + 1] - 1
+
+def cursor_left(word):
+    if cursor_pos == 0:
+        if cursor_para > 0:
+            move_cursor(cursor_para - 1, len(doc.paragraph(cursor_para - 1)))
+        return
+    text = doc.paragraph(cursor_para)
+    pos = cursor_pos - 1
+    if word:
+        while pos > 0 and text[pos].isspace():
+            pos -= 1
+        while pos > 0 and not text[pos - 1].isspace():
+            pos -= 1
+    move_cursor(cursor_para, pos)
+
+def cursor_right(word):
+    text = doc.paragraph(cursor_para)
+    if cursor_pos == len(text):
+        if cursor_para < doc.count() - 1:
+            move_cursor(cursor_para + 1, 0)
+        return
+    pos = cursor_pos + 1
+    if word:
+        while pos < len(text) and not text[pos].isspace():
+            pos += 1
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+    move_cursor(cursor_para, pos)
+
+def cursor_vertical(step):
+    #up (-1) or down (+1) a display line, keeping the column
+    line = doc.line_at(cursor_para, cursor_pos)
+    col = cursor_pos - doc.breaks(cursor_para)[line]
+    para, line = cursor_para, line + step
+    if line < 0:
+        if para == 0:
+            return
+        para -= 1
+        line = len(doc.breaks(para)) - 1
+    elif line >= len(doc.breaks(para)):
+        if para == doc.count() - 1:
+            return
+        para += 1
+        line = 0
+    move_cursor(para, min(doc.breaks(para)[line] + col, line_end(para, line)))
+
+def cursor_home():
+    line = doc.line_at(cursor_para, cursor_pos)
+    move_cursor(cursor_para, doc.breaks(cursor_para)[line])
+
+def cursor_end():
+    line = doc.line_at(cursor_para, cursor_pos)
+    move_cursor(cursor_para, line_end(cursor_para, line))
     
 def handle_key_down(e): #keys being held, ie modifier keys
     global shift_active
@@ -191,7 +909,6 @@ def handle_key_down(e): #keys being held, ie modifier keys
     
 
 def handle_key_press(e):
-    global cursor_position
     global typing_last_time
     global display_start_line
     global needs_display_update
@@ -199,7 +916,6 @@ def handle_key_press(e):
     global shift_active
     global exit_cleanup
     global input_content
-    global previous_lines
     global display_updating
     global input_catchup
     global control_active
@@ -208,9 +924,7 @@ def handle_key_press(e):
     
     #save via ctrl + s
     if e.name== "s" and control_active:
-        timestamp = time.strftime("%Y%m%d%H%M%S")  # Format: YYYYMMDDHHMMSS
-        filename = os.path.join(os.path.dirname(__file__), 'data', f'zw_{timestamp}.txt')
-        save_previous_lines(filename, previous_lines)
+        archive_document()
         
         console_message = f"[Saved]"
         update_display()
@@ -330,16 +1044,13 @@ def handle_key_press(e):
         
         needs_display_update = True
 
-    #new file (clear) via ctrl + n
+    #new document via ctrl + n, the current one stays open
     if e.name== "n" and control_active: #ctrl+n
-        #save the cache first
-        timestamp = time.strftime("%Y%m%d%H%M%S")  # Format: YYYYMMDDHHMMSS
-        filename = os.path.join(os.path.dirname(__file__), 'data', f'zw_{timestamp}.txt')
-        save_previous_lines(filename, previous_lines)
+        leave_document()
         
         #create a blank doc
-        previous_lines.clear()
-        input_content = ""
+        timestamp = time.strftime("%Y%m%d%H%M%S")  # Format: YYYYMMDDHHMMSS
+        use_document(docs.new(f'doc_{timestamp}.txt', time.time()))
 
         console_message = f"[New]"
         update_display()
@@ -347,25 +1058,124 @@ def handle_key_press(e):
         console_message = ""
         update_display()
 
-    if e.name== "down" or e.name== "right":
+    #open a saved draft via ctrl + o
+    if e.name== "o" and control_active:
+        # Unhook keyboard temporarily
+        keyboard.unhook_all()
+
+        name = browse_archives()
+        if name is not None:
+            open_archive(name)
+            input_content = ""
+            scrollindex = 1
+            console_message = f"[Opened]"
+
+        # Re-hook keyboard
+        keyboard.on_press(handle_key_down, suppress=False)
+        keyboard.on_release(handle_key_press, suppress=True)
+
+        needs_display_update = True
+        control_active = False  # its release went to the browser
+        return
+
+    #undo via ctrl + z, redo via ctrl + y
+    if e.name== "z" and control_active:
+        undo_edit()
+        input_catchup = True
+
+    if e.name== "y" and control_active:
+        redo_edit()
+        input_catchup = True
+
+    #find a draft by what is in it via ctrl + f
+    if e.name== "f" and control_active:
+        # Unhook keyboard temporarily
+        keyboard.unhook_all()
+
+        name = search_archives()
+        if name is not None and name != os.path.basename(file_path):
+            open_archive(name)
+            input_content = ""
+            scrollindex = 1
+            console_message = f"[Opened]"
+
+        # Re-hook keyboard
+        keyboard.on_press(handle_key_down, suppress=False)
+        keyboard.on_release(handle_key_press, suppress=True)
+
+        needs_display_update = True
+        control_active = False  # its release went to the search screen
+        return
+
+    #earlier saves of this document and what changed since, via ctrl + h
+    if e.name== "h" and control_active:
+        # Unhook keyboard temporarily
+        keyboard.unhook_all()
+
+        rev = browse_history()
+        if rev is not None:
+            open_revision(rev)
+            input_content = ""
+            scrollindex = 1
+            console_message = f"[r{rev}]"
+
+        # Re-hook keyboard
+        keyboard.on_press(handle_key_down, suppress=False)
+        keyboard.on_release(handle_key_press, suppress=True)
+
+        needs_display_update = True
+        control_active = False  # its release went to the history screen
+        return
+
+    #storage writes this session via ctrl + i
+    if e.name== "i" and control_active:
+        # Unhook keyboard temporarily
+        keyboard.unhook_all()
+
+        show_stats()
+
+        # Re-hook keyboard
+        keyboard.on_press(handle_key_down, suppress=False)
+        keyboard.on_release(handle_key_press, suppress=True)
+
+        needs_display_update = True
+        control_active = False  # its release went to the stats screen
+        return
+
+    #arrows move the cursor through the whole document, ctrl+arrows by word
+    if e.name== "left":
+       cursor_left(control_active)
+
+    if e.name== "right":
+       cursor_right(control_active)
+
+    if e.name== "up":
+       cursor_vertical(-1)
+
+    if e.name== "down":
+       cursor_vertical(1)
+
+    if e.name== "home":
+       cursor_home()
+
+    if e.name== "end":
+       cursor_end()
+
+    if e.name== "page down":
        #move scrollindex down
        scrollindex = scrollindex - 1
        if scrollindex < 1:
             scrollindex = 1
        #--
-       console_message = (f'[{round(len(previous_lines)/lines_on_screen)-scrollindex+1}/{round(len(previous_lines)/lines_on_screen)}]')
-       update_display()
-       console_message = ""
+       show_page()
 
-    if e.name== "up" or e.name== "left":
+    if e.name== "page up":
        #move scrollindex up
        scrollindex = scrollindex + 1
-       if scrollindex > round(len(previous_lines)/lines_on_screen+1):
-            scrollindex = round(len(previous_lines)/lines_on_screen+1)
+       if scrollindex > max_scroll(scrollindex - 1):
+            scrollindex = max_scroll(scrollindex - 1)
        #--
-       console_message = (f'[{round(len(previous_lines)/lines_on_screen)-scrollindex+1}/{round(len(previous_lines)/lines_on_screen)}]')
-       update_display()
-       console_message = ""
+       show_page()
 
     #powerdown - could add an autosleep if you want to save battery
     if e.name == "esc" and control_active: #ctrl+esc
@@ -374,6 +1184,8 @@ def handle_key_press(e):
         display_draw.text((200, 240), "ZeroWriter Powered Down.", font=font24, fill=0)
         partial_buffer = epd.getbuffer(display_image)
         epd.display(partial_buffer)
+        saves.flush()
+        iostats.write_log(io_log_path)
         time.sleep(3)
         subprocess.run(['sudo', 'poweroff', '-f'])
         
@@ -382,19 +1194,22 @@ def handle_key_press(e):
         input_catchup = True
         
         
-    if e.name == "tab": 
+    #back to the previous document via ctrl + tab
+    if e.name == "tab" and control_active:
+        entry = docs.other()
+        if entry is not None:
+            leave_document()
+            use_document(docs.switch(entry, time.time()))
+
+    #close the document via ctrl + q, its file stays in /data
+    if e.name == "q" and control_active:
+        save_document(file_path)
+        use_document(docs.close(docs.current(), time.time()))
+        needs_display_update = True
+
+    if e.name == "tab" and not control_active: 
         #just using two spaces for tab, kind of cheating, whatever.
-        insert_character(" ")
-        insert_character(" ")
-        
-        # Check if adding the character exceeds the line length limit
-        if cursor_position > chars_per_line:
-            previous_lines.append(input_content)                
-            # Update input_content to contain the remaining characters
-            input_content = ""
-            needs_display_update = True #trigger a display refresh
-        # Update cursor_position to the length of the remaining input_content
-        cursor_position = len(input_content)
+        insert_character("  ")
         
         needs_input_update = True
         input_catchup = True
@@ -407,30 +1222,19 @@ def handle_key_press(e):
     elif e.name == "space": #space bar
         insert_character(" ")
         
-        # Check if adding the character exceeds the line length limit
-        if cursor_position > chars_per_line:
-            previous_lines.append(input_content)                
-            input_content = ""
-            needs_display_update = True
-        # Update cursor_position to the length of the remaining input_content
-        cursor_position = len(input_content)
-        
         needs_input_update = True
         input_catchup = True
     
     elif e.name == "enter":
-        if scrollindex>1:
-            #if you were reviewing text, jump to scrollindex=1
-            scrollindex = 1
+        if not cursor_on_screen():
+            #if you were reviewing text, jump back to the cursor
+            follow_cursor()
             update_display()
         else:
-            # Add the input to the previous_lines array
-            previous_lines.append(input_content)
-            input_content = "" #clears input content
-            cursor_position=0
+            # Break the paragraph at the cursor
+            commit_paragraph()
             #save the file when enter is pressed
-            save_previous_lines(file_path, previous_lines)
-            needs_display_update = True
+            save_document(file_path)
             input_catchup = True
         
     if e.name == 'ctrl': #if control is released
@@ -442,28 +1246,12 @@ def handle_key_press(e):
     elif len(e.name) == 1 and control_active == False:  # letter and number input
         
         if shift_active:
-            char = keymaps.shift_mapping.get(e.name)
-            input_content += char
+            char = keymaps.shift_mapping.get(e.name, e.name)
         else:
-            input_content += e.name
-            
-        cursor_position += 1
-        needs_input_update = True
+            char = e.name
 
-        # Check if adding the character exceeds the line length limit
-        if cursor_position > chars_per_line:
-            # Find the last space character before the line length limit
-            last_space = input_content.rfind(' ', 0, chars_per_line)
-            sentence = input_content[:last_space]
-            # Append the sentence to the previous lines
-            previous_lines.append(sentence)                
-
-            # Update input_content to contain the remaining characters
-            input_content = input_content[last_space + 1:]
-            needs_display_update=True
-            
-        # Update cursor_position to the length of the remaining input_content
-        cursor_position = len(input_content)                
+        # wraps onto a new display line when the input line runs out of pixels
+        insert_character(char)
 
     typing_last_time = time.time()
     
@@ -481,7 +1269,8 @@ signal.signal(signal.SIGINT, handle_interrupt)
 #init_display routine
 epd.init()
 epd.Clear
-previous_lines = load_previous_lines(file_path)#('previous_lines.txt')
+docs.save()
+input_content = doc.input_line()
 epd.init_Partial()
 epd.Clear
 needs_display_update = True
@@ -502,16 +1291,32 @@ try:
         
         # Only refresh if enough time has passed AND we need an update
         if needs_input_update and (current_time - last_refresh_time) >= REFRESH_INTERVAL:
-            if scrollindex == 1:  # Only update input if we're on current page
-                update_input_area()
-                needs_input_update = False
-                last_refresh_time = current_time
+            update_input_area()
+            needs_input_update = False
+            last_refresh_time = current_time
         
         # Full display refresh (less frequent)
         if needs_display_update and not display_updating:
             update_display()
             needs_display_update = False
             last_refresh_time = current_time
+
+        # Status corner only, when its numbers moved (wpm keeps falling while idle)
+        if (scrollindex == 1 and not needs_input_update and status_text is not None
+                and current_time - last_status_update >= STATUS_INTERVAL
+                and status_lines(current_time) != status_text):
+            update_status()
+            last_refresh_time = current_time
+
+        # Autosave, the line being typed included
+        if autosaves.due(current_time):
+            save_document(file_path, kind='autosave')
+
+        # Count the display lines of a loaded document a few paragraphs at a time,
+        #for the page numbers; pages cached without them are drawn again once it is done
+        if (not needs_input_update and not needs_display_update
+                and doc.known_line_count() is None and doc.count_lines(COUNT_BUDGET)):
+            pages.clear()
         
         time.sleep(0.01)  # Small sleep to prevent CPU spinning
         
@@ -520,6 +1325,9 @@ except KeyboardInterrupt:
 
 finally:
     keyboard.unhook_all()
+    saves.flush()
+    print(saves.stats())
+    iostats.write_log(io_log_path)
     epd.init()
     time.sleep(1)
     epd.Clear()
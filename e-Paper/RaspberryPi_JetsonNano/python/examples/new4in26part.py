@@ -41,6 +41,10 @@ import time
 EPD_WIDTH  = 800
 EPD_HEIGHT = 480
 
+# SPI clock profile for the SSD1683 (datasheet allows 20MHz writes). Leaves margin
+# for jumper wires; calibrate_spi.py finds the fastest clock a given unit handles.
+SPI_SPEED_HZ = 10000000
+
 GRAY1 = 0xff  # white
 GRAY2 = 0xC0
 GRAY3 = 0x80  # gray
@@ -56,6 +60,7 @@ class EPD:
         self.cs_pin = epdconfig.CS_PIN
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        epdconfig.set_spi_speed(SPI_SPEED_HZ)
         self.GRAY1 = GRAY1
         self.GRAY2 = GRAY2
         self.GRAY3 = GRAY3
@@ -345,24 +350,12 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
-        buf = [0xFF] * (int(self.width / 8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        
-        if imwidth == self.width and imheight == self.height:
-            for y in range(imheight):
-                for x in range(imwidth):
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif imwidth == self.height and imheight == self.width:
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy * self.width) / 8)] &= ~(0x80 >> (y % 8))
-        
+        # packed in bulk by PIL rather than pixel by pixel; RAM uses 1=white like PIL
+        buf = epdconfig.getbuffer_1bpp(image, self.width, self.height)
+        if buf is None:
+            logger.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
+            # return a blank buffer
+            return [0xFF] * (int(self.width / 8) * self.height)
         return buf
 
     def display(self, image):
@@ -382,6 +375,68 @@ class EPD:
         # Don't wait for busy - this speeds things up significantly
         self.ReadBusy()
 
+    def set_rows(self, Y_first, Y_last):
+        # RAM window and counter for image rows Y_first..Y_last. With data entry
+        # mode 0x01 (y-) from counter 0 in a height-1..0 window, image row j sits
+        # at RAM row -j mod height, so the window has to run downwards too.
+        first = (-Y_first) % self.height
+        last = (-Y_last) % self.height
+        self.send_command(0x45) # SET_RAM_Y_ADDRESS_START_END_POSITION
+        self.send_data(first & 0xFF)
+        self.send_data(first >> 8)
+        self.send_data(last & 0xFF)
+        self.send_data(last >> 8)
+
+        self.send_command(0x4E) # SET_RAM_X_ADDRESS_COUNTER
+        self.send_data(0x00)
+        self.send_data(0x00)
+
+        self.send_command(0x4F) # SET_RAM_Y_ADDRESS_COUNTER
+        self.send_data(first & 0xFF)
+        self.send_data(first >> 8)
+
+    def display_Partial(self, image, X_start, Y_start, X_end, Y_end):
+        # Only push the rows Y_start..Y_end (exclusive) of the full frame image.
+        # Rows are written whole, so X_start/X_end only widen to the full line.
+        if self.width % 8 == 0:
+            linewidth = int(self.width / 8)
+        else:
+            linewidth = int(self.width / 8) + 1
+
+        Y_start = max(Y_start, 0)
+        Y_end = min(Y_end, self.height)
+        if Y_end <= Y_start:
+            return
+
+        if Y_start == 0:
+            # row 0 is at RAM row 0 and row 1 at the other end, write it on its own
+            self.set_rows(0, 0)
+            self.send_command(0x24)
+            self.send_data2(bytes(image[0:linewidth]))
+            Y_start = 1
+        if Y_start < Y_end:
+            self.set_rows(Y_start, Y_end - 1)
+            self.send_command(0x24)
+            self.send_data2(bytes(image[Y_start * linewidth:Y_end * linewidth]))
+
+        # back to the full window and counters init() set up, for display()
+        self.send_command(0x45)
+        self.send_data((self.height-1) & 0xFF)
+        self.send_data((self.height-1) >> 8)
+        self.send_data(0x00)
+        self.send_data(0x00)
+        self.send_command(0x4E)
+        self.send_data(0x00)
+        self.send_data(0x00)
+        self.send_command(0x4F)
+        self.send_data(0x00)
+        self.send_data(0x00)
+
+        self.send_command(0x22) # Display Update Control
+        self.send_data(0xC7)
+        self.send_command(0x20) # Activate Display Update Sequence
+        self.ReadBusy()
+
     def Clear(self):
         if self.width % 8 == 0:
             linewidth = int(self.width / 8)
@@ -42,11 +42,10 @@
 # You could modify it to work with other waveshare displays, but it will be harder to get the
 # latency to a respectable level.
 #
-# The partial update code is old waveshare code and doesn't actually function.
 # There have been a few other minor adjustments that I found improved latency performance.
-# The display buffer itself is a bit troublesome. It needs to buffer the entire screen,
-# even if you are only updating one line. The typewriter application works around it,
-# but there would be big improvements in latency if we could write a better buffer.
+# The driver keeps a shadow of the panel RAM (self.DATA), so display_Partial() can push
+# just a window (e.g. the input line) instead of the entire screen. With the fast LUT
+# the old data plane (0x10) is not needed at all and is skipped.
 #
 # 
 
@@ -60,6 +59,9 @@ import time
 EPD_WIDTH  = 400
 EPD_HEIGHT = 300
 
+# SPI clock profile for the UC8176. Waveshare ships 4MHz; calibrate_spi.py can push it
+SPI_SPEED_HZ = 4000000
+
 
 GRAY1 = 0xff  # white
 GRAY2 = 0xff
@@ -81,11 +83,17 @@ class EPD:
         self.cs_pin = epdconfig.CS_PIN
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        epdconfig.set_spi_speed(SPI_SPEED_HZ)
         self.GRAY1 = GRAY1  # white
         self.GRAY2 = GRAY2
         self.GRAY3 = GRAY3  # gray
         self.GRAY4 = GRAY4  # Blackest
-        self.DATA = [0x00] * 15000
+        # shadow of the panel's 0x13 (new data) RAM, white after Clear()
+        self.DATA = bytearray([0xFF] * (int(EPD_WIDTH / 8) * EPD_HEIGHT))
+        self.BLANK = bytes(self.DATA) # cached all-white frame for Clear()
+        # The fast LUT drives each pixel by its new value only (ww == bw and
+        # wb == bb), so the old plane (0x10) is only needed with the slow LUT.
+        self.needs_old_data = True
 
     lut_vcom0 = [
         0x00, 0x0E, 0x00, 0x00, 0x00, 0x01,        
@@ -441,6 +449,7 @@ class EPD:
             0xF7)  # 97white border 77black border  VBDF 17|D7 VBDW 97 VBDB 57  VBDF F7 VBDW 77 VBDB 37  VBDR B7
 
         self.set_slow_lut()
+        self.needs_old_data = True
         self.ReadBusy() #added aug17
         # EPD hardware init end
         return 0
@@ -485,66 +494,89 @@ class EPD:
             0xF7)  #07def 97white border 77black border  VBDF *17*|D7 VBDW 97 VBDB 57  VBDF F7 VBDW 77 VBDB 37  VBDR B7
 
         self.set_lut()
+        self.needs_old_data = False
         #self.ReadBusy()
         # EPD hardware init end
         return 0
 
     def getbuffer(self, image):
-        #ms=time.time()
-        # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width / 8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if imwidth == self.width and imheight == self.height:
-            #logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif imwidth == self.height and imheight == self.width:
-            #logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy * self.width) / 8)] &= ~(0x80 >> (y % 8))
-        #print (time.time()-ms)
+        # packed in bulk by PIL rather than pixel by pixel; RAM uses 1=white like PIL
+        buf = epdconfig.getbuffer_1bpp(image, self.width, self.height)
+        if buf is None:
+            logger.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
+            # return a blank buffer
+            return [0xFF] * (int(self.width / 8) * self.height)
         return buf
 
     def display(self, image):
-        if self.width % 8 == 0:
-            linewidth = int(self.width / 8)
-        else:
-            linewidth = int(self.width / 8) + 1
-
         self.send_command(0x92) #91=partial 92=regular
         self.send_command(0x90)  # resolution setting
         #self.set_lut() #likely not needed each time as the LUT are set on init.
-        self.send_command(0x10)
-        self.send_data2([0xFF] * int(self.width * linewidth)) #high cpu overhead
+        if self.needs_old_data:
+            # the previous frame, from the shadow RAM
+            self.send_command(0x10)
+            self.send_data2(self.DATA)
         self.send_command(0x13)
         self.send_data2(image)
+        self.DATA[:] = bytes(image)
 
         self.send_command(0x12) #refresh
        
         #self.ReadBusy()
 
-
-    def Clear(self):
+    def display_Partial(self, image, X_start, Y_start, X_end, Y_end):
+        # Only push the window (X_end/Y_end exclusive) instead of the full frame.
+        # The old data for the window comes from the shadow RAM in self.DATA.
         if self.width % 8 == 0:
             linewidth = int(self.width / 8)
         else:
             linewidth = int(self.width / 8) + 1
 
+        # The window is byte aligned: round the start down and the end up
+        X_start = max(X_start, 0) // 8
+        X_end = min((X_end + 7) // 8, linewidth)
+        Y_start = max(Y_start, 0)
+        Y_end = min(Y_end, self.height)
+        if X_end <= X_start or Y_end <= Y_start:
+            return
+
+        old = bytearray()
+        new = bytearray()
+        for j in range(Y_start, Y_end):
+            row = slice(j * linewidth + X_start, j * linewidth + X_end)
+            old += self.DATA[row]
+            self.DATA[row] = bytes(image[row])
+            new += self.DATA[row]
+
+        self.send_command(0x91) #enter partial mode
+        self.send_command(0x90) #partial window
+        self.send_data((X_start * 8) >> 8)
+        self.send_data((X_start * 8) & 0xff)
+        self.send_data((X_end * 8 - 1) >> 8)
+        self.send_data((X_end * 8 - 1) & 0xff)
+        self.send_data(Y_start >> 8)
+        self.send_data(Y_start & 0xff)
+        self.send_data((Y_end - 1) >> 8)
+        self.send_data((Y_end - 1) & 0xff)
+        self.send_data(0x28) #gates outside the window are not scanned
+
+        if self.needs_old_data:
+            self.send_command(0x10)
+            self.send_data2(old)
+        self.send_command(0x13)
+        self.send_data2(new)
+
+        self.send_command(0x12) #refresh
+        #display() sends 0x92 to leave partial mode
+
+
+    def Clear(self):
         self.send_command(0x10)
-        self.send_data2([0xff] * int(self.height * linewidth))
+        self.send_data2(self.BLANK)
 
         self.send_command(0x13)
-        self.send_data2([0xff] * int(self.height * linewidth))
+        self.send_data2(self.BLANK)
+        self.DATA[:] = self.BLANK
 
         self.send_command(0x12)
         #self.ReadBusy()
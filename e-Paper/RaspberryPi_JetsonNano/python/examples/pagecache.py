@@ -0,0 +1,65 @@
+# pagecache
+#
+# Least recently used cache of rendered pages for scrolling, keyed by
+# (document version, page). A page is whatever the render function returns for
+# a key, here the drawn image and its packed framebuffer, so flipping to a
+# cached page is only the SPI push.
+#
+# Pages next to the one on screen can be rendered ahead of time on a background
+# thread while the user reads. A new document version changes every key, so
+# pages of older versions are never hit again and just age out. render returns
+# None when the version asked for is gone by the time it is drawn.
+
+import threading
+import queue
+from collections import OrderedDict
+
+
+class PageCache:
+    def __init__(self, render, size=8):
+        self.render = render  # render(version, page) -> page
+        self.size = size
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+        self.wanted = queue.Queue()
+        self.worker = None
+
+    def get(self, version, page):
+        key = (version, page)
+        with self.lock:
+            cached = self.pages.get(key)
+            if cached is not None:
+                self.pages.move_to_end(key)
+                return cached
+        rendered = self.render(version, page)
+        if rendered is not None:
+            self.put(key, rendered)
+        return rendered
+
+    def put(self, key, rendered):
+        with self.lock:
+            self.pages[key] = rendered
+            self.pages.move_to_end(key)
+            while len(self.pages) > self.size:
+                self.pages.popitem(last=False)
+
+    def prefetch(self, version, pages):
+        for page in pages:
+            self.wanted.put((version, page))
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run, daemon=True)
+            self.worker.start()
+
+    def run(self):
+        while True:
+            key = self.wanted.get()
+            with self.lock:
+                cached = key in self.pages
+            if not cached:
+                rendered = self.render(*key)
+                if rendered is not None:
+                    self.put(key, rendered)
+
+    def clear(self):
+        with self.lock:
+            self.pages.clear()
@@ -0,0 +1,135 @@
+# saver
+#
+# Saves run on a background writer thread, so enter and ctrl+s don't wait for
+# the SD card. Every save writes the whole file to <file>.tmp, fsyncs it and
+# renames it over the file: power loss leaves the old version or the new one,
+# never a truncated one. A Document still reading the old file through its
+# mmap keeps the old inode and is not disturbed by the rename.
+#
+# Saves wait in a bounded queue of files. Saving a file that is still waiting
+# replaces what was queued for it, since only the newest content matters (what
+# was to run after the earlier save runs after the new one instead); when
+# the queue is full the caller waits for room. stats() reports save latency
+# (queued to renamed) and queue depth, like epdconfig.spi_stats() does for SPI.
+
+import os
+import time
+import threading
+import iostats
+from collections import OrderedDict
+
+
+def write_atomic(path, write, kind='save'):
+    # write(file) fills a temp file that then replaces path, counted in iostats as kind
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+            written = file.tell()
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    # the rename is only on the card once the directory is
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        iostats.count(kind, written, fsyncs=1)
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+    iostats.count(kind, written, fsyncs=2)
+
+
+def chain(first, then):
+    # both callbacks of two folded saves still run
+    if first is None or then is None:
+        return first or then
+
+    def done(path):
+        first(path)
+        then(path)
+    return done
+
+
+class Saver:
+    def __init__(self, depth=8):
+        self.depth = depth
+        self.pending = OrderedDict()  # path -> (write, done, time queued, kind)
+        self.busy = False
+        self.cond = threading.Condition()
+        self.worker = None
+        self.reset_stats()
+
+    def save(self, path, write, done=None, kind='save'):
+        # queue write(file) for path, done(path) is called once it is renamed in.
+        # kind is what iostats counts the write as.
+        with self.cond:
+            while path not in self.pending and len(self.pending) >= self.depth:
+                self.cond.wait()
+            queued = time.perf_counter()
+            if path in self.pending:
+                _, earlier, queued, _ = self.pending.pop(path)
+                done = chain(earlier, done)
+            self.pending[path] = (write, done, queued, kind)
+            self.counters['max_queued'] = max(self.counters['max_queued'], len(self.pending))
+            self.cond.notify_all()
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, daemon=True)
+                self.worker.start()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                path, (write, done, queued, kind) = self.pending.popitem(last=False)
+                self.busy = True
+                self.cond.notify_all()
+
+            start = time.perf_counter()
+            failed = False
+            try:
+                write_atomic(path, write, kind)
+                if done is not None:
+                    done(path)
+            except Exception as error:
+                failed = True
+                print(f"save of {path} failed: {error}")
+            finish = time.perf_counter()
+
+            with self.cond:
+                self.busy = False
+                if failed:
+                    self.counters['errors'] += 1
+                else:
+                    self.counters['saves'] += 1
+                    self.counters['seconds'] += finish - start
+                    self.counters['latency'] = finish - queued
+                    self.counters['max_latency'] = max(self.counters['max_latency'], finish - queued)
+                self.cond.notify_all()
+
+    def flush(self):
+        # wait until everything queued so far is on disk
+        with self.cond:
+            while self.pending or self.busy:
+                self.cond.wait()
+
+    def stats(self):
+        with self.cond:
+            stats = dict(self.counters)
+            stats['queued'] = len(self.pending) + (1 if self.busy else 0)
+            return stats
+
+    def reset_stats(self):
+        self.counters = {'saves': 0, 'errors': 0, 'seconds': 0.0,
+                         'latency': 0.0, 'max_latency': 0.0, 'max_queued': 0}
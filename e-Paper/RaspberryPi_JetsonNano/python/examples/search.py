@@ -0,0 +1,194 @@
+# search
+#
+# Full text search over the drafts in data/ (*.txt), from an inverted index in
+# data/search.db (sqlite, so the index stays on disk and queries don't load it).
+#
+# A posting is (word, file, byte offset of the paragraph). A query finds the
+# paragraphs holding all its words in the index, ranks files by how many of
+# their paragraphs match, and reads only the paragraphs shown as snippets,
+# seeking straight to their offsets; exact phrase matches rank first.
+#
+# Files are indexed when they are saved. The crc32 of every CHECK_BYTES block
+# of what was indexed is kept with the file, so a save only has its paragraphs
+# from the first block that changed on indexed again: just the new ones when
+# the file was appended to (cache.txt on every enter), and from the edited
+# paragraph on after an edit further up. Snapshots in a
+# snapshot.SnapshotStore are indexed under their own name when they are taken
+# and their snippets are read from the store's chunks.
+
+import os
+import re
+import zlib
+import fnmatch
+import sqlite3
+import threading
+from array import array
+
+DB_NAME = 'search.db'
+PATTERN = '*.txt'
+CHECK_BYTES = 4096
+SCHEMA = 2  # PRAGMA user_version of the tables below, older ones are rebuilt
+BATCH = 1000  # postings written per executemany
+
+WORD = re.compile(r"\w+")
+
+
+def words(text):
+    return WORD.findall(text.lower())
+
+
+def block_crcs(file, block, end):
+    # crc32 of each CHECK_BYTES block of the file from block on, up to end
+    crcs = array('I')
+    pos = block * CHECK_BYTES
+    file.seek(pos)
+    while pos < end:
+        data = file.read(min(CHECK_BYTES, end - pos))
+        if not data:
+            break
+        crcs.append(zlib.crc32(data))
+        pos += len(data)
+    return crcs
+
+
+class SearchIndex:
+    def __init__(self, directory, store=None):
+        self.directory = directory
+        self.store = store
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(directory, DB_NAME), check_same_thread=False)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA:
+            # an index from an older version, refresh() builds it again
+            self.db.executescript("DROP TABLE IF EXISTS postings; DROP TABLE IF EXISTS files;")
+            self.db.execute(f"PRAGMA user_version = {SCHEMA}")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY, name TEXT UNIQUE,
+                mtime REAL, size INTEGER, end INTEGER, crcs BLOB);
+            CREATE TABLE IF NOT EXISTS postings (
+                word TEXT, file INTEGER, offset INTEGER,
+                PRIMARY KEY (word, file, offset)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_file ON postings (file, offset);
+        """)
+
+    def update(self, path, name=None):
+        # call after writing a file in the directory, or after snapshotting path as name
+        name = name or os.path.basename(path)
+        with self.lock, self.db:
+            row = self.db.execute("SELECT id, end, crcs FROM files WHERE name=?", (name,)).fetchone()
+            with open(path, 'rb') as file:
+                stat = os.fstat(file.fileno())
+                if row is None:
+                    file_id = self.db.execute("INSERT INTO files (name) VALUES (?)", (name,)).lastrowid
+                    crcs = array('I')
+                    start = 0
+                else:
+                    file_id, end = row[0], row[1]
+                    crcs = array('I', row[2] or b'')
+                    # the first block that changed since it was indexed
+                    same = 0
+                    for crc in block_crcs(file, 0, min(end, stat.st_size)):
+                        if same == len(crcs) or crc != crcs[same]:
+                            break
+                        same += 1
+                    if same == len(crcs) and end <= stat.st_size:
+                        start = end
+                    else:
+                        # back to the last paragraph that starts in the unchanged blocks,
+                        # the bytes before it and its newline are the same as when indexed
+                        start = self.db.execute(
+                            "SELECT max(offset) FROM postings WHERE file=? AND offset<=?",
+                            (file_id, same * CHECK_BYTES)).fetchone()[0] or 0
+                        self.db.execute("DELETE FROM postings WHERE file=? AND offset>=?", (file_id, start))
+                end = self.index_from(file, file_id, start)
+                block = start // CHECK_BYTES
+                crcs = crcs[:block] + block_crcs(file, block, end)
+            self.db.execute("UPDATE files SET mtime=?, size=?, end=?, crcs=? WHERE id=?",
+                            (stat.st_mtime, stat.st_size, end, crcs.tobytes(), file_id))
+
+    def index_from(self, file, file_id, start):
+        # index the complete paragraphs from start, returns where they end
+        file.seek(start)
+        offset = start
+        batch = []
+        for line in file:
+            if not line.endswith(b'\n'):
+                break  # still being written, picked up once it is finished
+            text = line.decode('utf-8', errors='replace')
+            batch.extend((word, file_id, offset) for word in set(words(text)))
+            offset += len(line)
+            if len(batch) >= BATCH:
+                self.db.executemany("INSERT OR IGNORE INTO postings VALUES (?, ?, ?)", batch)
+                batch = []
+        self.db.executemany("INSERT OR IGNORE INTO postings VALUES (?, ?, ?)", batch)
+        return offset
+
+    def refresh(self):
+        # index files changed outside the editor and forget deleted ones, by stat alone
+        with self.lock:
+            known = {name: (mtime, size) for name, mtime, size in
+                     self.db.execute("SELECT name, mtime, size FROM files")}
+        seen = set()
+        for entry in os.scandir(self.directory):
+            if not fnmatch.fnmatch(entry.name, PATTERN) or not entry.is_file():
+                continue
+            seen.add(entry.name)
+            stat = entry.stat()
+            if known.get(entry.name) != (stat.st_mtime, stat.st_size):
+                self.update(entry.path)
+        if self.store is not None:
+            seen.update(self.store.names())
+        with self.lock, self.db:
+            for name in set(known) - seen:
+                file_id = self.db.execute("SELECT id FROM files WHERE name=?", (name,)).fetchone()[0]
+                self.db.execute("DELETE FROM postings WHERE file=?", (file_id,))
+                self.db.execute("DELETE FROM files WHERE id=?", (file_id,))
+
+    def search(self, query, limit=10, tries=8):
+        # [(name, snippet)] best first
+        terms = sorted(set(words(query)))
+        if not terms:
+            return []
+        phrase = " ".join(words(query))
+        match = " INTERSECT ".join(["SELECT file, offset FROM postings WHERE word=?"] * len(terms))
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT f.id, f.name, count(*) FROM (" + match + ") m "
+                "JOIN files f ON f.id = m.file GROUP BY m.file "
+                "ORDER BY count(*) DESC, f.mtime DESC LIMIT ?", terms + [limit * 2]).fetchall()
+
+            results = []
+            for file_id, name, hits in rows:
+                # the first few matching paragraphs, looking for the words as a phrase
+                offsets = [offset for offset, in self.db.execute(
+                    "SELECT offset FROM (" + match + ") WHERE file=? ORDER BY offset LIMIT ?",
+                    terms + [file_id, tries])]
+                snippets = [self.snippet(name, offset, phrase) for offset in offsets]
+                snippets = [snippet for snippet in snippets if snippet is not None]
+                if not snippets:
+                    continue  # changed since it was indexed
+                exact, text = max(snippets, key=lambda snippet: snippet[0])
+                results.append((not exact, -hits, name, text))
+
+        results.sort(key=lambda result: result[:2])
+        return [(name, text) for _, _, name, text in results[:limit]]
+
+    def snippet(self, name, offset, phrase, width=36):
+        # (has the phrase, text around the first word) for the paragraph at offset
+        try:
+            if self.store is not None and self.store.has(name):
+                line = self.store.line_at(name, offset)
+            else:
+                with open(os.path.join(self.directory, name), 'rb') as file:
+                    file.seek(offset)
+                    line = file.readline()
+        except OSError:
+            return None
+        text = line.decode('utf-8', errors='replace').rstrip('\r\n')
+        exact = " " + phrase + " " in " " + " ".join(words(text)) + " "
+        at = text.lower().find(phrase.split(" ")[0])
+        start = max(0, at - width // 3)
+        return exact, text[start:start + width]
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,137 @@
+# snapshot
+#
+# Saved drafts (ctrl+s) as content addressed chunks instead of full copies, so
+# hourly snapshots of a long manuscript share everything that didn't change.
+#
+# A file is cut into chunks at paragraph ends chosen by the paragraph's own
+# crc32, so the cuts depend on the text and not on offsets: an edit changes
+# the chunk it falls in, and the chunks after it come out the same as before.
+# Chunks are kept between MIN_CHUNK and MAX_CHUNK bytes (a paragraph longer
+# than MAX_CHUNK is cut inside). Each chunk is stored once, as
+# chunks/<sha1[:2]>/<sha1>; a snapshot is a manifest in snapshots/<name>.json
+# listing its chunks and their lengths.
+#
+# Restoring a snapshot only concatenates its chunks. export() writes one back
+# as a plain <name> text file in the directory, which the archive and search
+# indexes then also pick up like any other draft.
+
+import os
+import json
+import zlib
+import hashlib
+from bisect import bisect_right
+import saver
+
+CHUNK_DIR = 'chunks'
+SNAPSHOT_DIR = 'snapshots'
+MIN_CHUNK = 1024
+MAX_CHUNK = 64 * 1024
+BOUNDARY_MASK = 0x7  # a paragraph ends a chunk if its crc32 has these bits clear, 1 in 8
+
+
+def chunks(file):
+    # the chunks of a binary file, in order
+    pending = []
+    size = 0
+    for line in file:
+        if len(line) > MAX_CHUNK:
+            if pending:
+                yield b''.join(pending)
+                pending = []
+                size = 0
+            for start in range(0, len(line), MAX_CHUNK):
+                yield line[start:start + MAX_CHUNK]
+            continue
+        pending.append(line)
+        size += len(line)
+        if size >= MAX_CHUNK or (size >= MIN_CHUNK and zlib.crc32(line) & BOUNDARY_MASK == 0):
+            yield b''.join(pending)
+            pending = []
+            size = 0
+    if pending:
+        yield b''.join(pending)
+
+
+class SnapshotStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.chunk_dir = os.path.join(directory, CHUNK_DIR)
+        self.snapshot_dir = os.path.join(directory, SNAPSHOT_DIR)
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    def manifest_path(self, name):
+        return os.path.join(self.snapshot_dir, name + '.json')
+
+    def store(self, path, kind='snapshot'):
+        # store the chunks of the file at path, returns ([[sha1, length]...], bytes newly stored)
+        listing = []
+        stored = 0
+        with open(path, 'rb') as file:
+            for chunk in chunks(file):
+                digest = hashlib.sha1(chunk).hexdigest()
+                chunk_path = self.chunk_path(digest)
+                if not os.path.exists(chunk_path):
+                    os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+                    saver.write_atomic(chunk_path, lambda out: out.write(chunk), kind)
+                    stored += len(chunk)
+                listing.append([digest, len(chunk)])
+        return listing, stored
+
+    def add(self, name, path):
+        # snapshot the file at path as name, returns (chunks, bytes newly stored)
+        listing, stored = self.store(path)
+        # chunks first, so a manifest on disk always has all of its chunks
+        manifest = json.dumps({'size': sum(length for _, length in listing), 'chunks': listing})
+        saver.write_atomic(self.manifest_path(name), lambda out: out.write(manifest.encode('utf-8')), 'snapshot')
+        return len(listing), stored
+
+    def manifest(self, name):
+        with open(self.manifest_path(name), 'r') as file:
+            return json.load(file)
+
+    def has(self, name):
+        return os.path.exists(self.manifest_path(name))
+
+    def names(self):
+        return [entry[:-len('.json')] for entry in os.listdir(self.snapshot_dir) if entry.endswith('.json')]
+
+    def read_chunk(self, digest):
+        with open(self.chunk_path(digest), 'rb') as file:
+            return file.read()
+
+    def read(self, listing):
+        # the bytes of a chunk listing
+        return b''.join(self.read_chunk(digest) for digest, _ in listing)
+
+    def restore(self, name, path, kind='restore'):
+        # write the snapshot out to path as a plain file
+        listing = self.manifest(name)['chunks']
+
+        def write(out):
+            for digest, _ in listing:
+                out.write(self.read_chunk(digest))
+        saver.write_atomic(path, write, kind)
+
+    def export(self, name):
+        path = os.path.join(self.directory, name)
+        self.restore(name, path, 'export')
+        return path
+
+    def line_at(self, name, offset):
+        # the line starting at byte offset, read from the chunks it is in
+        listing = self.manifest(name)['chunks']
+        starts = [0]
+        for _, length in listing:
+            starts.append(starts[-1] + length)
+        index = bisect_right(starts, offset) - 1
+        if index >= len(listing):
+            return b''
+        data = self.read_chunk(listing[index][0])[offset - starts[index]:]
+        while b'\n' not in data and index + 1 < len(listing):
+            index += 1
+            data += self.read_chunk(listing[index][0])
+        return data.split(b'\n', 1)[0]
@@ -0,0 +1,75 @@
+# stats
+#
+# Running word and character counts for the status area, kept up to date from
+# the edits instead of recounting the document. An edit only changes the word
+# count of the words it touches, so only those are looked at.
+#
+# Words per minute is the net words typed over the last WINDOW seconds, kept
+# in one bucket per second so each key costs the same however fast you type.
+
+WINDOW = 60  # seconds behind the words per minute figure
+
+
+def word_delta(text, pos, removed, inserted):
+    # change in word count when removed chars at pos become inserted
+    start = pos
+    while start > 0 and not text[start - 1].isspace():
+        start -= 1
+    end = pos + removed
+    while end < len(text) and not text[end].isspace():
+        end += 1
+    before = text[start:end]
+    after = text[start:pos] + inserted + text[pos + removed:end]
+    return len(after.split()) - len(before.split())
+
+
+class Stats:
+    def __init__(self, now):
+        self.reset(0, 0, now)
+
+    def reset(self, words, chars, now):
+        # a new session starts with a document of this size
+        self.words = words
+        self.chars = chars
+        self.session_start = words
+        self.buckets = [0] * WINDOW
+        self.second = int(now)
+        self.window_words = 0
+
+    def advance(self, now):
+        # empty the buckets of the seconds that passed
+        second = int(now)
+        for s in range(self.second + 1, self.second + 1 + min(second - self.second, WINDOW)):
+            self.window_words -= self.buckets[s % WINDOW]
+            self.buckets[s % WINDOW] = 0
+        self.second = max(self.second, second)
+
+    def count(self, words, chars, now):
+        self.words += words
+        self.chars += chars
+        self.advance(now)
+        self.buckets[self.second % WINDOW] += words
+        self.window_words += words
+
+    def edit(self, text, pos, removed, inserted, now):
+        self.count(word_delta(text, pos, removed, inserted), len(inserted) - removed, now)
+
+    def split(self, text, pos, now):
+        # a paragraph break at pos separates words like a space, but isn't a char
+        self.count(word_delta(text, pos, 0, "\n"), 0, now)
+
+    def join(self, text, pos, now):
+        # text was two paragraphs, broken at pos
+        broken = text[:pos] + "\n" + text[pos:]
+        self.count(word_delta(broken, pos, 1, ""), 0, now)
+
+    def session_words(self):
+        return self.words - self.session_start
+
+    def wpm(self, now):
+        self.advance(now)
+        return max(0, self.window_words) * 60 // WINDOW
+
+    def status(self, now):
+        # two short lines for the corner of the input area
+        return f"{self.words}w {self.chars}c", f"{self.session_words():+d} {self.wpm(now)}wpm"
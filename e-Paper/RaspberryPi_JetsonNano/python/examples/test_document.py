@@ -0,0 +1,196 @@
+import os
+import random
+import document
+import wordwrap
+
+
+class Font:
+    # narrow and wide letters, like a proportional font
+    def getlength(self, ch):
+        return 6 if ch in 'ilt .,' else 12
+
+
+def new_document():
+    return document.Document(wordwrap.WordWrap(Font(), 200))
+
+
+def text(doc):
+    return [doc.paragraph(i) for i in range(doc.count())]
+
+
+def write_file(path, paragraphs):
+    with open(path, 'w') as file:
+        file.write("".join(paragraph + '\n' for paragraph in paragraphs))
+
+
+def reopen(path):
+    doc = new_document()
+    doc.load(path)
+    return doc
+
+
+def test_same_length_edit_at_the_start_survives_reopening(tmp_path):
+    path = str(tmp_path / 'cache.txt')
+    write_file(path, ['abc def'] + [f'para {i} ' + 'x' * 30 for i in range(400)])
+    reopen(path).close()  # leaves a saved line index behind
+
+    doc = new_document()
+    doc.load(path)
+    doc.join(1)
+    doc.split(0, 3)
+    expected = text(doc)
+    doc.save(path)
+    doc.close()
+
+    assert text(reopen(path)) == expected
+
+
+def test_snapshot_is_written_after_the_file_was_replaced(tmp_path):
+    path = str(tmp_path / 'cache.txt')
+    write_file(path, [f'para {i}' for i in range(1000)])
+    doc = new_document()
+    doc.load(path)
+    doc.edit(doc.count() - 1, 0, 0, 'typed')
+    write = doc.snapshot()
+
+    doc.edit(doc.count() - 1, 5, 0, ' later')
+    doc.close()
+    # saved over by a later save
+    write_file(str(tmp_path / 'later.txt'), ['x'])
+    os.replace(str(tmp_path / 'later.txt'), path)
+
+    with open(str(tmp_path / 'saved.txt'), 'wb') as file:
+        write(file)
+    assert text(reopen(str(tmp_path / 'saved.txt'))) == [f'para {i}' for i in range(1000)] + ['typed', '']
+
+
+def test_every_snapshot_starts_at_the_beginning(tmp_path):
+    path = str(tmp_path / 'cache.txt')
+    write_file(path, [f'para {i}' for i in range(100)])
+    doc = new_document()
+    doc.load(path)
+    for name in ('one.txt', 'two.txt'):
+        with open(str(tmp_path / name), 'wb') as file:
+            doc.snapshot()(file)
+    with open(path, 'rb') as original, open(str(tmp_path / 'two.txt'), 'rb') as second:
+        assert second.read() == original.read()
+
+
+def test_mid_file_edits_round_trip_through_save_and_load(tmp_path):
+    path = str(tmp_path / 'cache.txt')
+    write_file(path, [f'paragraph {i} with a few more words in it' for i in range(300)])
+    random.seed(7)
+    for _ in range(5):
+        doc = reopen(path)
+        for step in range(60):
+            index = random.randrange(doc.count())
+            action = random.random()
+            if action < 0.5:
+                pos = random.randint(0, len(doc.paragraph(index)))
+                removed = random.randint(0, len(doc.paragraph(index)) - pos)
+                doc.edit(index, pos, removed, random.choice(['', 'x', ' typed words ']))
+            elif action < 0.75:
+                doc.split(index, random.randint(0, len(doc.paragraph(index))))
+            elif index > 0:
+                doc.join(index)
+            # cached layouts follow the paragraphs they belong to
+            for i in list(doc.layout):
+                assert doc.layout[i] == doc.wrap.breaks(doc.paragraph(i))
+        expected = text(doc)
+        if expected[-1] != '':
+            expected.append('')  # the typing paragraph after the saved text
+        doc.save(path)
+        doc.close()
+        assert text(reopen(path)) == expected
+
+
+def test_pages_are_the_lines_above_the_input_line(tmp_path):
+    path = str(tmp_path / 'cache.txt')
+    write_file(path, [f'para {i} ' + 'words go here ' * (i % 4) for i in range(50)])
+    doc = reopen(path)
+    doc.edit(doc.count() - 1, 0, 0, 'typing')
+    lines = [line for index in range(doc.count()) for line in doc.lines(index)]
+    above = lines[:-1]
+    assert doc.page(1, 5) == above[-5:]
+    assert doc.page(2, 5) == above[-10:-5]
+    # the top screen is a full one
+    top = (len(above) + 4) // 5
+    assert doc.page(top, 5) == above[:5]
+
+
+def test_every_change_is_a_new_version(tmp_path):
+    path = str(tmp_path / 'cache.txt')
+    write_file(path, ['one two', 'three'])
+    doc = reopen(path)
+    seen = {doc.version}
+    doc.edit(0, 3, 0, ' and a half')
+    seen.add(doc.version)
+    doc.split(1, 2)
+    seen.add(doc.version)
+    doc.join(2)
+    seen.add(doc.version)
+    doc.page(1, 5)  # laying out a page is not a change
+    seen.add(doc.version)
+    assert len(seen) == 4
+
+
+def test_editing_near_the_top_holds_only_that_paragraph(tmp_path):
+    path = str(tmp_path / 'cache.txt')
+    paragraphs = [f'para {i} ' + 'x' * 60 for i in range(20000)]
+    write_file(path, paragraphs)
+    with open(path, 'a') as file:
+        file.write('no newline yet')
+    doc = reopen(path)
+    loaded = doc.memory()
+    doc.edit(5, 0, 0, 'edited ')
+    doc.split(10, 4)
+    doc.join(12)
+    assert doc.memory() - loaded < 2000
+    assert doc.paragraph(5) == 'edited ' + paragraphs[5]
+    assert doc.paragraph(20000) == 'no newline yet'
+
+    expected = text(doc)
+    doc.save(path)
+    doc.close()
+    assert text(reopen(path)) == expected
+
+
+def test_scrolling_back_lays_out_only_what_it_passes(tmp_path):
+    path = str(tmp_path / 'cache.txt')
+    write_file(path, [f'para {i} ' + 'words go here ' * (i % 5) for i in range(5000)])
+    doc = reopen(path)
+    assert doc.line_count(30) == 30
+    assert len(doc.counts) < 40
+    assert doc.known_line_count() is None
+
+    expected = sum(len(doc.wrap.breaks(doc.paragraph(i))) for i in range(doc.count()))
+    while not doc.count_lines(100):
+        pass
+    assert doc.known_line_count() == expected
+
+    # edits keep the count without laying out the rest again
+    doc.split(10, 3)
+    doc.edit(20, 0, 0, 'words go here ' * 20)
+    doc.join(4000)
+    expected = sum(len(doc.wrap.breaks(doc.paragraph(i))) for i in range(doc.count()))
+    assert doc.known_line_count() == expected
+    assert doc.line_count() == expected
+
+
+def test_line_count_stays_right_while_it_is_being_counted(tmp_path):
+    path = str(tmp_path / 'cache.txt')
+    write_file(path, [f'para {i} ' + 'words go here ' * (i % 7) for i in range(2000)])
+    doc = reopen(path)
+    random.seed(3)
+    while not doc.count_lines(37):
+        for _ in range(3):
+            index = random.randrange(1, doc.count())
+            action = random.random()
+            if action < 0.4:
+                doc.split(index, random.randint(0, len(doc.paragraph(index))))
+            elif action < 0.8:
+                doc.join(index)
+            else:
+                doc.edit(index, 0, 0, 'more words ' * random.randint(0, 9))
+    expected = sum(len(doc.wrap.breaks(doc.paragraph(i))) for i in range(doc.count()))
+    assert doc.known_line_count() == expected
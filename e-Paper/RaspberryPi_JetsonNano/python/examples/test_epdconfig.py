@@ -0,0 +1,94 @@
+import os
+import time
+import random
+import importlib.util
+import pytest
+from PIL import Image
+
+def load(name, path):
+    # epdconfig picks the board's GPIO and SPI when it is imported, so off the
+    # device there is nothing to test
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except (ImportError, RuntimeError, OSError) as error:
+        pytest.skip(f"epdconfig needs the panel's board: {error}")
+    return module
+
+
+COPIES = {
+    'examples': os.path.join(os.path.dirname(__file__), 'epdconfig.py'),
+    'examples/waveshare_epd': os.path.join(os.path.dirname(__file__), 'waveshare_epd', 'epdconfig.py'),
+    'lib': os.path.join(os.path.dirname(__file__), '..', 'lib', 'waveshare_epd', 'epdconfig.py'),
+}
+
+
+def getbuffer_per_pixel(image, width, height):
+    # how the drivers packed frames before getbuffer_1bpp, one pixel at a time
+    buf = [0xFF] * (int(width / 8) * height)
+    image_monocolor = image.convert('1')
+    imwidth, imheight = image_monocolor.size
+    pixels = image_monocolor.load()
+    if imwidth == width and imheight == height:
+        for y in range(imheight):
+            for x in range(imwidth):
+                if pixels[x, y] == 0:
+                    buf[int((x + y * width) / 8)] &= ~(0x80 >> (x % 8))
+    elif imwidth == height and imheight == width:
+        for y in range(imheight):
+            for x in range(imwidth):
+                newx = y
+                newy = height - x - 1
+                if pixels[x, y] == 0:
+                    buf[int((newx + newy * width) / 8)] &= ~(0x80 >> (y % 8))
+    return bytearray(buf)
+
+
+def random_image(width, height):
+    random.seed(width * height)
+    image = Image.new('1', (width, height))
+    image.putdata([random.choice((0, 255)) for _ in range(width * height)])
+    return image
+
+
+@pytest.fixture(params=sorted(COPIES))
+def epdconfig(request):
+    return load('epdconfig_' + request.param.replace('/', '_'), COPIES[request.param])
+
+
+def test_bulk_packing_matches_the_pixel_loop(epdconfig):
+    width, height = 200, 96
+    for image in (random_image(width, height), random_image(height, width)):
+        expected = getbuffer_per_pixel(image, width, height)
+        assert epdconfig.getbuffer_1bpp(image, width, height) == expected
+        inverted = bytearray(0xFF ^ byte for byte in expected)
+        assert epdconfig.getbuffer_1bpp(image, width, height, invert=True) == inverted
+    assert epdconfig.getbuffer_1bpp(random_image(10, 10), width, height) is None
+
+
+def test_bulk_packing_is_faster(epdconfig):
+    # an 800x480 frame, the size main.py pushes
+    image = random_image(800, 480)
+    start = time.perf_counter()
+    getbuffer_per_pixel(image, 800, 480)
+    per_pixel = time.perf_counter() - start
+    start = time.perf_counter()
+    buf = epdconfig.getbuffer_1bpp(image, 800, 480, invert=True)
+    bulk = time.perf_counter() - start
+    print(f"per pixel {per_pixel * 1000:.1f}ms, bulk {bulk * 1000:.2f}ms")
+    assert len(buf) == 800 // 8 * 480
+    assert bulk * 10 < per_pixel
+
+    # and inverting a packed frame with the table beats a loop over its bytes
+    frame = bytearray(buf)
+    start = time.perf_counter()
+    for i in range(len(frame)):
+        frame[i] ^= 0xFF
+    loop = time.perf_counter() - start
+    start = time.perf_counter()
+    translated = bytes(buf).translate(epdconfig.INVERT_TABLE)
+    table = time.perf_counter() - start
+    print(f"invert loop {loop * 1000:.1f}ms, table {table * 1000:.2f}ms")
+    assert translated == frame
+    assert table * 10 < loop
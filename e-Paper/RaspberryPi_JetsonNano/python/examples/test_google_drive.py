@@ -0,0 +1,233 @@
+import os
+import re
+import json
+import email
+import hashlib
+import threading
+import http.server
+import urllib.parse
+import pytest
+import google_drive
+
+pytest.importorskip('googleapiclient')
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    # just enough of the Drive v3 API for DriveSync: multipart create, media
+    # update, list by name and batches of lists. server.answers holds statuses
+    # to answer the next requests with instead.
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, body, content_type='application/json'):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def message(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        return email.message_from_bytes(b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + body)
+
+    def handle_request(self):
+        server = self.server
+        server.requests.append((self.command, self.path.split('?')[0]))
+        if server.answers:
+            code = server.answers.pop(0)
+            self.message() if self.command != 'GET' else None
+            return self.reply(code, {'error': {'code': code, 'message': 'stand-in'}})
+        path = urllib.parse.urlparse(self.path)
+        if self.command == 'POST' and path.path.endswith('/batch/drive/v3'):
+            return self.batch(self.message())
+        if self.command == 'GET' and path.path.endswith('/drive/v3/files'):
+            return self.reply(200, self.list(urllib.parse.parse_qs(path.query)['q'][0]))
+        if path.path.startswith('/upload/drive/v3/files'):
+            if urllib.parse.parse_qs(path.query)['uploadType'] == ['media']:
+                # content only, as sent by update
+                metadata, content = None, self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            else:
+                metadata, content = self.message().get_payload()
+                content = content.get_payload(decode=True)
+            file_id = path.path[len('/upload/drive/v3/files/'):]
+            if self.command == 'POST':
+                server.created += 1
+                file_id = f'id{server.created}'
+                server.files[file_id] = json.loads(metadata.get_payload())['name']
+            elif file_id not in server.files:
+                return self.reply(404, {'error': {'code': 404, 'message': 'not found'}})
+            server.contents[file_id] = content
+            return self.reply(200, {'id': file_id})
+        self.reply(400, {'error': {'code': 400, 'message': 'not in the stand-in'}})
+
+    do_GET = do_POST = do_PATCH = handle_request
+
+    def list(self, query):
+        name = re.match(r"name = '(.*?)'", query).group(1)
+        return {'files': [{'id': file_id, 'md5Checksum': hashlib.md5(self.server.contents[file_id]).hexdigest()}
+                          for file_id, file_name in self.server.files.items() if file_name == name]}
+
+    def batch(self, message):
+        parts = []
+        for part in message.get_payload():
+            request = part.get_payload()
+            target = request.split(' ')[1]
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(target).query)['q'][0]
+            content_id = part['Content-ID'].strip('<>')
+            parts.append(f"--batch\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                         f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n{json.dumps(self.list(query))}\r\n")
+        self.reply(200, ("".join(parts) + "--batch--\r\n").encode(), 'multipart/mixed; boundary=batch')
+
+
+@pytest.fixture
+def stand_in():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    server.requests, server.answers, server.files, server.contents, server.created = [], [], {}, {}, 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(google_drive, 'BACKOFF_START', 0.01)
+    monkeypatch.setattr(google_drive, 'BACKOFF_MAX', 0.05)
+
+
+def client(server):
+    return google_drive.DriveClient(api_endpoint=f'http://127.0.0.1:{server.server_port}/')
+
+
+def test_queue_uploads_through_the_api(tmp_path, stand_in):
+    (tmp_path / 'cache.txt').write_text('first draft\n')
+    sync = google_drive.DriveSync(str(tmp_path), client(stand_in))
+    sync.upload(str(tmp_path / 'cache.txt'))
+    assert sync.flush(10)
+    assert list(stand_in.files.values()) == ['cache.txt']
+    assert stand_in.contents['id1'] == b'first draft\n'
+
+
+def test_server_errors_are_retried(tmp_path, stand_in, fast_backoff):
+    (tmp_path / 'cache.txt').write_text('draft\n')
+    stand_in.answers = [503, 429]
+    sync = google_drive.DriveSync(str(tmp_path), client(stand_in))
+    sync.upload(str(tmp_path / 'cache.txt'))
+    assert sync.flush(10)
+    assert sync.stats()['failures'] == 2
+    assert stand_in.contents['id1'] == b'draft\n'
+
+
+def test_refused_upload_is_parked_and_the_rest_go_on(tmp_path, stand_in, fast_backoff):
+    for name in ('a.txt', 'b.txt'):
+        (tmp_path / name).write_text(name + '\n')
+    sync = google_drive.DriveSync(str(tmp_path), client(stand_in))
+    stand_in.answers = [400]  # the lookup of a.txt
+    sync.queue([(str(tmp_path / 'a.txt'), 'a.txt'), (str(tmp_path / 'b.txt'), 'b.txt')])
+    assert sync.flush(10)
+    assert sync.stats()['parked_files'] == 1
+    assert list(stand_in.files.values()) == ['b.txt']
+
+    # parked files are kept in the queue file, and go again when queued again
+    reopened = google_drive.DriveSync(str(tmp_path), client(stand_in))
+    assert list(reopened.parked) == [str(tmp_path / 'a.txt')]
+    reopened.upload(str(tmp_path / 'a.txt'))
+    assert reopened.flush(10)
+    assert sorted(stand_in.files.values()) == ['a.txt', 'b.txt']
+
+
+def test_endless_server_errors_park_the_file(tmp_path, stand_in, fast_backoff):
+    (tmp_path / 'cache.txt').write_text('draft\n')
+    stand_in.answers = [500] * google_drive.MAX_ATTEMPTS
+    sync = google_drive.DriveSync(str(tmp_path), client(stand_in))
+    sync.upload(str(tmp_path / 'cache.txt'))
+    assert sync.flush(10)
+    assert sync.stats()['parked_files'] == 1
+    assert stand_in.files == {}
+
+
+def test_network_down_keeps_the_queue(tmp_path, stand_in, fast_backoff):
+    (tmp_path / 'cache.txt').write_text('draft\n')
+    port = stand_in.server_port
+    stand_in.shutdown()
+    stand_in.server_close()
+    offline = google_drive.DriveClient(api_endpoint=f'http://127.0.0.1:{port}/')
+    sync = google_drive.DriveSync(str(tmp_path), offline)
+    sync.upload(str(tmp_path / 'cache.txt'))
+    assert not sync.flush(0.5)
+    stats = sync.stats()
+    assert stats['failures'] >= 2 and stats['queued'] == 1 and stats['parked_files'] == 0
+
+
+def test_local_errors_are_not_retried():
+    assert not google_drive.transient(ValueError('bad credentials file'))
+    assert not google_drive.transient(FileNotFoundError(2, 'No such file'))
+    assert google_drive.transient(ConnectionRefusedError(111, 'Connection refused'))
+
+
+def test_missing_credentials_stop_the_worker(tmp_path, capsys):
+    (tmp_path / 'cache.txt').write_text('draft\n')
+    sync = google_drive.DriveSync(str(tmp_path), google_drive.DriveClient(str(tmp_path / 'credentials.json')))
+    sync.upload(str(tmp_path / 'cache.txt'))
+    assert not sync.flush(10)
+    assert 'credentials.json' in sync.stats()['error']
+    assert sync.stats()['queued'] == 1
+    sync.upload(str(tmp_path / 'cache.txt'))  # doesn't start it again
+    assert sync.worker is None
+    assert capsys.readouterr().out.count('Drive sync stopped') == 1
+
+
+def test_refused_login_stops_the_worker(tmp_path, stand_in, fast_backoff):
+    (tmp_path / 'cache.txt').write_text('draft\n')
+    stand_in.answers = [401]
+    sync = google_drive.DriveSync(str(tmp_path), client(stand_in))
+    sync.upload(str(tmp_path / 'cache.txt'))
+    assert not sync.flush(10)
+    assert sync.stats()['error'] is not None
+    assert len(stand_in.requests) == 1
+
+
+def synced_directory(tmp_path, server):
+    for i in range(5):
+        (tmp_path / f'draft{i}.txt').write_text(f'draft {i}\n')
+    sync = google_drive.DriveSync(str(tmp_path), client(server))
+    assert sync.sync() == 5
+    assert sync.flush(10)
+    assert len(server.files) == 5
+    server.requests.clear()
+    return sync
+
+
+def test_sync_with_nothing_changed_makes_no_requests(tmp_path, stand_in):
+    sync = synced_directory(tmp_path, stand_in)
+    assert sync.sync() == 0
+    assert sync.flush(10)
+    reopened = google_drive.DriveSync(str(tmp_path), client(stand_in))
+    assert reopened.sync() == 0
+    assert stand_in.requests == []
+
+
+def test_changed_file_is_updated_under_its_id(tmp_path, stand_in):
+    sync = synced_directory(tmp_path, stand_in)
+    file_id = sync.manifest['draft2.txt']['id']
+    (tmp_path / 'draft2.txt').write_text('draft 2, edited\n')
+    assert sync.sync() == 1
+    assert sync.flush(10)
+    assert stand_in.requests == [('PATCH', f'/upload/drive/v3/files/{file_id}')]
+    assert stand_in.contents[file_id] == b'draft 2, edited\n'
+    assert len(stand_in.files) == 5 and sync.stats()['parked_files'] == 0
+
+
+def test_lost_manifest_is_looked_up_without_duplicates(tmp_path, stand_in):
+    sync = synced_directory(tmp_path, stand_in)
+    (tmp_path / 'draft4.txt').write_text('draft 4, edited\n')
+    os.remove(sync.manifest_path)
+    sync = google_drive.DriveSync(str(tmp_path), client(stand_in))
+    assert sync.sync() == 5
+    assert sync.flush(10)
+    file_id = [file_id for file_id, name in stand_in.files.items() if name == 'draft4.txt'][0]
+    # one batch of lookups, and only the edited file sent, in place
+    assert stand_in.requests == [('POST', '/batch/drive/v3'), ('PATCH', f'/upload/drive/v3/files/{file_id}')]
+    assert len(stand_in.files) == 5
+    assert sync.stats()['skipped'] == 4
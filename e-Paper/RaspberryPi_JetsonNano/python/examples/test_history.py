@@ -0,0 +1,104 @@
+import random
+import threading
+import document
+import history
+import saver
+import snapshot
+import wordwrap
+
+
+class Font:
+    def getlength(self, ch):
+        return 6 if ch in 'ilt .,' else 12
+
+
+def test_revisions_recorded_from_the_first_changed_paragraph(tmp_path):
+    store = snapshot.SnapshotStore(str(tmp_path))
+    log = history.History(str(tmp_path), store)
+    path = str(tmp_path / 'cache.txt')
+    with open(path, 'w') as file:
+        file.write("".join(f"paragraph {i} with some words\n" for i in range(200)))
+
+    doc = document.Document(wordwrap.WordWrap(Font(), 200))
+    doc.load(path)
+    random.seed(5)
+    revisions = []
+    for step in range(120):
+        for _ in range(random.randint(1, 4)):
+            index = random.randrange(doc.count())
+            action = random.random()
+            if action < 0.6:
+                doc.edit(index, 0, 0, f"e{step} ")
+            elif action < 0.8:
+                doc.split(index, len(doc.paragraph(index)) // 2)
+            elif index > 0:
+                doc.join(index)
+        number = log.saving(path, doc.take_changed())
+        doc.save(path)
+        if step % 7 == 3:
+            continue  # a save whose callback never ran, its changes go with the next one
+        rev = log.record(path, step, number)
+        text = [doc.paragraph(i) for i in range(doc.count())]
+        if text[-1] == "":
+            text = text[:-1]
+        if rev is not None:
+            revisions.append((rev, text))
+
+    reopened = history.History(str(tmp_path), store)
+    for rev, text in revisions:
+        assert reopened.checkout('cache.txt', rev) == text
+
+
+def test_nothing_changed_records_nothing(tmp_path):
+    log = history.History(str(tmp_path), snapshot.SnapshotStore(str(tmp_path)))
+    path = tmp_path / 'cache.txt'
+    path.write_text('one\ntwo\n')
+    assert log.record(str(path), 1) == 0
+    assert log.record(str(path), 2, log.saving(str(path), None)) is None
+    path.write_text('one\ntwo\nthree\n')
+    assert log.record(str(path), 3, log.saving(str(path), 2)) == 1
+    assert log.checkout('cache.txt', 1) == ['one', 'two', 'three']
+
+
+def test_overlapping_saves_are_both_recorded(tmp_path):
+    log = history.History(str(tmp_path), snapshot.SnapshotStore(str(tmp_path)))
+    path = str(tmp_path / 'cache.txt')
+    with open(path, 'w') as file:
+        file.write("".join(f"paragraph {i}\n" for i in range(100)))
+    doc = document.Document(wordwrap.WordWrap(Font(), 200))
+    doc.load(path)
+    saves = saver.Saver()
+    recorded = []
+
+    def save(write):
+        number = log.saving(path, doc.take_changed())
+        saves.save(path, write, lambda path: recorded.append(log.record(path, len(recorded), number)))
+
+    save(doc.snapshot())
+    saves.flush()
+    # save A is being written when save B of a change further up is queued
+    doc.edit(80, 0, 0, 'A ')
+    writing, release = threading.Event(), threading.Event()
+    snapshot_a = doc.snapshot()
+
+    def write_a(file):
+        writing.set()
+        release.wait()
+        snapshot_a(file)
+    save(write_a)
+    writing.wait()
+    doc.edit(20, 0, 0, 'B ')
+    save(doc.snapshot())
+    release.set()
+    saves.flush()
+
+    assert recorded == [0, 1, 2]
+    assert log.checkout('cache.txt', 1)[80] == 'A paragraph 80'
+    assert log.checkout('cache.txt', 1)[20] == 'paragraph 20'
+    assert log.checkout('cache.txt', 2)[20] == 'B paragraph 20'
+
+    # and the next save still lines up with the file
+    doc.edit(50, 0, 0, 'C ')
+    save(doc.snapshot())
+    saves.flush()
+    assert log.checkout('cache.txt', 3) == [doc.paragraph(i) for i in range(doc.count() - 1)]
@@ -0,0 +1,67 @@
+import os
+import threading
+import pytest
+import saver
+
+
+def test_failed_write_keeps_the_old_file(tmp_path):
+    path = str(tmp_path / 'cache.txt')
+    saver.write_atomic(path, lambda file: file.write(b'old\n'))
+
+    def write(file):
+        file.write(b'half of the new')
+        raise OSError(28, 'No space left on device')
+    with pytest.raises(OSError):
+        saver.write_atomic(path, write)
+    with open(path, 'rb') as file:
+        assert file.read() == b'old\n'
+    assert os.listdir(str(tmp_path)) == ['cache.txt']
+
+
+def test_failed_rename_leaves_no_temp_file(tmp_path):
+    path = tmp_path / 'cache.txt'
+    path.mkdir()  # can't be replaced by a file
+    with pytest.raises(OSError):
+        saver.write_atomic(str(path), lambda file: file.write(b'new\n'))
+    assert os.listdir(str(tmp_path)) == ['cache.txt']
+
+
+def test_failed_save_is_counted_and_done_is_not_called(tmp_path, capsys):
+    saves = saver.Saver()
+    called = []
+
+    def write(file):
+        raise ValueError('broken snapshot')
+    saves.save(str(tmp_path / 'cache.txt'), write, called.append)
+    saves.save(str(tmp_path / 'other.txt'), lambda file: file.write(b'fine\n'), called.append)
+    saves.flush()
+    assert called == [str(tmp_path / 'other.txt')]
+    assert saves.stats()['errors'] == 1 and saves.stats()['saves'] == 1
+    assert 'broken snapshot' in capsys.readouterr().out
+    assert not os.path.exists(str(tmp_path / 'cache.txt'))
+
+
+def test_saves_waiting_for_the_same_file_are_folded(tmp_path):
+    saves = saver.Saver()
+    started, release = threading.Event(), threading.Event()
+
+    def blocked(file):
+        started.set()
+        release.wait()
+        file.write(b'first\n')
+    saves.save(str(tmp_path / 'busy.txt'), blocked)
+    started.wait()
+
+    path = str(tmp_path / 'cache.txt')
+    written, called = [], []
+    for i in range(3):
+        def write(file, i=i):
+            written.append(i)
+            file.write(f'version {i}\n'.encode())
+        saves.save(path, write, lambda path, i=i: called.append(i))
+    release.set()
+    saves.flush()
+    assert written == [2]
+    assert called == [0, 1, 2]
+    with open(path) as file:
+        assert file.read() == 'version 2\n'
@@ -0,0 +1,49 @@
+import search
+
+
+def body(count):
+    return "".join(f"paragraph {i} of the body text goes on for a while\n" for i in range(count))
+
+
+def test_edit_before_the_end_is_reindexed(tmp_path):
+    path = tmp_path / 'cache.txt'
+    path.write_text('teh quick fox\n' + body(400))
+    index = search.SearchIndex(str(tmp_path))
+    index.update(str(path))
+    assert [name for name, _ in index.search('teh')] == ['cache.txt']
+
+    path.write_text('the quick fox\n' + body(400) + 'a new ending\n')
+    index.update(str(path))
+    assert index.search('teh') == []
+    assert [name for name, _ in index.search('the quick')] == ['cache.txt']
+    assert [name for name, _ in index.search('new ending')] == ['cache.txt']
+    assert [name for name, _ in index.search('paragraph 399')] == ['cache.txt']
+
+
+def test_edit_in_the_middle_keeps_what_is_before_it(tmp_path):
+    path = tmp_path / 'cache.txt'
+    lines = body(1000).splitlines(keepends=True)
+    path.write_text("".join(lines))
+    index = search.SearchIndex(str(tmp_path))
+    index.update(str(path))
+
+    lines[600] = 'a changed paragraph\n'
+    path.write_text("".join(lines))
+    index.update(str(path))
+    assert index.search('paragraph 600') == []
+    assert [name for name, _ in index.search('changed paragraph')] == ['cache.txt']
+    for i in (0, 599, 601, 999):
+        assert [name for name, _ in index.search(f'paragraph {i}')] == ['cache.txt']
+
+
+def test_appended_paragraphs_are_found(tmp_path):
+    path = tmp_path / 'cache.txt'
+    path.write_text(body(10) + 'unfinished')
+    index = search.SearchIndex(str(tmp_path))
+    index.update(str(path))
+    assert index.search('unfinished') == []
+
+    path.write_text(body(10) + 'unfinished line\nand another\n')
+    index.update(str(path))
+    assert [name for name, _ in index.search('unfinished line')] == ['cache.txt']
+    assert [name for name, _ in index.search('another')] == ['cache.txt']
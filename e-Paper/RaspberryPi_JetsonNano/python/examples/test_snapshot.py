@@ -0,0 +1,56 @@
+import random
+import snapshot
+
+
+def draft(count, seed=1):
+    random.seed(seed)
+    words = ['the', 'long', 'manuscript', 'goes', 'on', 'and', 'on', 'again']
+    return [" ".join(random.choice(words) for _ in range(random.randint(3, 30))) for _ in range(count)]
+
+
+def write(path, paragraphs):
+    path.write_bytes("".join(p + '\n' for p in paragraphs).encode('utf-8'))
+
+
+def test_restore_gives_back_the_file(tmp_path):
+    store = snapshot.SnapshotStore(str(tmp_path / 'data'))
+    path = tmp_path / 'cache.txt'
+    write(path, draft(3000))
+    path.write_bytes(path.read_bytes() + b'x' * (snapshot.MAX_CHUNK * 2 + 5) + b'\nno newline at the end')
+    store.add('one.txt', str(path))
+    original = path.read_bytes()
+
+    path.write_text('overwritten\n')
+    store.restore('one.txt', str(tmp_path / 'restored.txt'))
+    assert (tmp_path / 'restored.txt').read_bytes() == original
+    assert open(store.export('one.txt'), 'rb').read() == original
+
+
+def test_edit_stores_only_the_chunks_around_it(tmp_path):
+    store = snapshot.SnapshotStore(str(tmp_path / 'data'))
+    path = tmp_path / 'cache.txt'
+    paragraphs = draft(3000)
+    write(path, paragraphs)
+    chunks, stored = store.add('one.txt', str(path))
+    assert stored == path.stat().st_size and chunks > 10
+
+    paragraphs[1500] = 'a paragraph rewritten in the middle'
+    write(path, paragraphs)
+    _, stored = store.add('two.txt', str(path))
+    assert 0 < stored <= 2 * snapshot.MAX_CHUNK
+    _, stored = store.add('three.txt', str(path))
+    assert stored == 0
+
+
+def test_line_at_reads_across_chunks(tmp_path):
+    store = snapshot.SnapshotStore(str(tmp_path / 'data'))
+    path = tmp_path / 'cache.txt'
+    paragraphs = draft(2000)
+    paragraphs[1000] = 'y' * (snapshot.MAX_CHUNK + 100)  # cut inside, over two chunks
+    write(path, paragraphs)
+    store.add('one.txt', str(path))
+    offset = 0
+    for paragraph in paragraphs:
+        assert store.line_at('one.txt', offset) == paragraph.encode('utf-8')
+        offset += len(paragraph.encode('utf-8')) + 1
+    assert store.line_at('one.txt', offset) == b''
@@ -0,0 +1,133 @@
+import random
+import undo
+import document
+import wordwrap
+
+
+class Font:
+    def getlength(self, ch):
+        return 6 if ch in 'ilt .,' else 12
+
+
+class Editor:
+    # the document side of main.py's edit_paragraph, commit_paragraph,
+    # delete_character, undo_edit and redo_edit
+    def __init__(self, paragraphs):
+        self.doc = document.Document(wordwrap.WordWrap(Font(), 200))
+        for index, paragraph in enumerate(paragraphs):
+            if index:
+                self.doc.split(index - 1, len(self.doc.paragraph(index - 1)))
+            self.doc.edit(index, 0, 0, paragraph)
+        self.log = undo.UndoLog()
+        self.now = 0.0
+
+    def text(self):
+        return [self.doc.paragraph(i) for i in range(self.doc.count())]
+
+    def apply(self, kind, para, pos, removed, inserted):
+        if kind == 'edit':
+            self.doc.edit(para, pos, len(removed), inserted)
+        elif kind == 'split':
+            self.doc.split(para, pos)
+        elif kind == 'join':
+            self.doc.join(para)
+
+    def type(self, para, pos, text):
+        self.log.record('edit', para, pos, "", text, self.now)
+        self.apply('edit', para, pos, "", text)
+
+    def backspace(self, para, pos):
+        if pos > 0:
+            removed = self.doc.paragraph(para)[pos - 1]
+            self.log.record('edit', para, pos - 1, removed, "", self.now)
+            self.apply('edit', para, pos - 1, removed, "")
+        elif para > 0:
+            at = len(self.doc.paragraph(para - 1))
+            self.log.record('join', para, at, "", "", self.now)
+            self.apply('join', para, at, "", "")
+
+    def enter(self, para, pos):
+        self.log.record('split', para, pos, "", "", self.now)
+        self.apply('split', para, pos, "", "")
+
+    def undo(self):
+        op = self.log.undo()
+        if op is None:
+            return False
+        kind, para, pos, removed, inserted = op[:5]
+        if kind == 'edit':
+            self.apply('edit', para, pos, inserted, removed)
+        elif kind == 'split':
+            self.apply('join', para + 1, pos, "", "")
+        elif kind == 'join':
+            self.apply('split', para - 1, pos, "", "")
+        return True
+
+    def redo(self):
+        op = self.log.redo()
+        if op is None:
+            return False
+        self.apply(*op[:5])
+        return True
+
+
+def test_burst_of_typing_is_one_operation():
+    editor = Editor(["hello"])
+    for i, ch in enumerate(" world"):
+        editor.type(0, 5 + i, ch)
+        editor.now += 0.1
+    editor.backspace(0, 11)
+    assert editor.text() == ["hello worl"]
+    assert len(editor.log.done) == 1
+    editor.undo()
+    assert editor.text() == ["hello"]
+
+
+def test_pause_starts_a_new_operation():
+    editor = Editor([""])
+    editor.type(0, 0, "a")
+    editor.now += undo.BURST_SECONDS + 1
+    editor.type(0, 1, "b")
+    editor.undo()
+    assert editor.text() == ["a"]
+
+
+def test_undo_and_redo_across_splits_and_joins():
+    random.seed(11)
+    editor = Editor(["the first paragraph", "a second one", "third"])
+    states = [editor.text()]
+    for _ in range(300):
+        para = random.randrange(editor.doc.count())
+        pos = random.randint(0, len(editor.doc.paragraph(para)))
+        action = random.random()
+        if action < 0.5:
+            editor.type(para, pos, random.choice("abc "))
+        elif action < 0.75:
+            editor.backspace(para, pos)
+        else:
+            editor.enter(para, pos)
+        editor.now += random.choice([0.1, 0.1, 5])
+        states.append(editor.text())
+    final = editor.text()
+
+    while editor.undo():
+        pass
+    assert editor.text() == states[0]
+    while editor.redo():
+        pass
+    assert editor.text() == final
+
+    # undo part of the way, then a new edit drops what was undone
+    for _ in range(10):
+        editor.undo()
+    editor.enter(0, 0)
+    assert not editor.redo()
+    assert editor.log.undone == []
+
+
+def test_oldest_operations_are_dropped_past_the_limit():
+    log = undo.UndoLog(limit=10 * undo.OP_OVERHEAD)
+    for i in range(50):
+        log.record('split', i, 0, "", "", i * 10.0)
+    assert len(log.done) == 10
+    assert log.done[0][1] == 40
@@ -0,0 +1,40 @@
+import random
+import wordwrap
+
+
+class Font:
+    # narrow and wide letters, like a proportional font
+    def getlength(self, ch):
+        return 6 if ch in 'ilt .,' else 12
+
+
+def test_breaks_fit_the_width():
+    wrap = wordwrap.WordWrap(Font(), 120)
+    text = "the quick brown fox jumps over the lazy dog " * 5
+    breaks = wrap.breaks(text)
+    assert breaks[0] == 0
+    for line in wrap.lines(text, breaks):
+        assert wrap.width(line.rstrip(' ')) <= 120
+    assert "".join(wrap.lines(text, breaks)) == text
+
+
+def test_word_longer_than_a_line_is_split():
+    wrap = wordwrap.WordWrap(Font(), 60)
+    text = "a " + "w" * 12 + " b"
+    lines = wrap.lines(text, wrap.breaks(text))
+    assert lines == ["a ", "wwwww", "wwwww", "ww b"]
+
+
+def test_reflow_matches_wrapping_from_scratch():
+    wrap = wordwrap.WordWrap(Font(), 150)
+    random.seed(3)
+    letters = "abcdefghijklmnopqrstuvwxyz    ."
+    text = "".join(random.choice(letters) for _ in range(400))
+    breaks = wrap.breaks(text)
+    for _ in range(1000):
+        pos = random.randint(0, len(text))
+        removed = min(random.choice([0, 0, 1, 3, 20]), len(text) - pos)
+        inserted = "".join(random.choice(letters) for _ in range(random.choice([0, 1, 1, 5, 30])))
+        text = text[:pos] + inserted + text[pos + removed:]
+        breaks = wrap.reflow(text, breaks, pos, removed, len(inserted))
+        assert breaks == wrap.breaks(text)
@@ -0,0 +1,93 @@
+# undo
+#
+# Undo/redo as a log of the edits themselves rather than copies of the text.
+# An operation is [kind, paragraph, pos, removed, inserted, time]:
+#   'edit'   removed text at pos in the paragraph became inserted
+#   'split'  the paragraph was broken at pos (enter)
+#   'join'   the paragraph was joined onto the one before it, at pos
+#
+# Keys typed in a burst (no pause longer than BURST_SECONDS) extend the same
+# operation, so one undo takes back a run of typing or of backspacing.
+#
+# The log is a ring: once the text it holds passes limit bytes, the oldest
+# operations are dropped.
+
+from collections import deque
+
+BURST_SECONDS = 2.0
+OP_OVERHEAD = 100  # rough bytes per operation besides its text
+
+
+def cost(op):
+    return OP_OVERHEAD + len(op[3]) + len(op[4])
+
+
+class UndoLog:
+    def __init__(self, limit=256 * 1024):
+        self.limit = limit
+        self.done = deque()
+        self.undone = []
+        self.size = 0
+        self.merge = False  # whether the next edit may extend the last operation
+
+    def clear(self):
+        self.done.clear()
+        self.undone = []
+        self.size = 0
+        self.merge = False
+
+    def record(self, kind, paragraph, pos, removed, inserted, now):
+        for op in self.undone:
+            self.size -= cost(op)
+        self.undone = []
+
+        last = self.done[-1] if self.done and self.merge else None
+        if (last is not None and kind == 'edit' and last[0] == 'edit' and last[1] == paragraph
+                and now - last[5] < BURST_SECONDS):
+            before = cost(last)
+            if not removed and not last[3] and pos == last[2] + len(last[4]):
+                # typing on
+                last[4] += inserted
+            elif not inserted and not last[4] and pos + len(removed) == last[2]:
+                # backspacing on
+                last[2] = pos
+                last[3] = removed + last[3]
+            elif (not inserted and not last[3] and pos + len(removed) == last[2] + len(last[4])
+                    and last[4].endswith(removed)):
+                # backspacing over what this burst typed
+                last[4] = last[4][:len(last[4]) - len(removed)]
+            else:
+                last = None
+            if last is not None:
+                last[5] = now
+                self.size += cost(last) - before
+                if not last[3] and not last[4]:
+                    self.done.pop()
+                    self.size -= cost(last)
+                    self.merge = False
+                return
+
+        op = [kind, paragraph, pos, removed, inserted, now]
+        self.done.append(op)
+        self.size += cost(op)
+        self.merge = kind == 'edit'
+        while self.size > self.limit and len(self.done) > 1:
+            self.size -= cost(self.done.popleft())
+
+    def undo(self):
+        # the operation to take back, or None
+        self.merge = False
+        if not self.done:
+            return None
+        op = self.done.pop()
+        self.undone.append(op)
+        return op
+
+    def redo(self):
+        # the operation to do again, or None
+        self.merge = False
+        if not self.undone:
+            return None
+        op = self.undone.pop()
+        self.done.append(op)
+        return op
@@ -34,6 +34,45 @@ import time
 
 logger = logging.getLogger(__name__)
 
+# EPD_SPI_HZ in the environment overrides the SPI clock chosen by the panel driver
+def spi_speed_hz(default):
+    return int(os.environ.get('EPD_SPI_HZ', default))
+
+# spidev rejects a single transfer larger than its bufsiz module parameter
+SPIDEV_BUFSIZ_PATH = '/sys/module/spidev/parameters/bufsiz'
+
+def spidev_bufsiz():
+    try:
+        with open(SPIDEV_BUFSIZ_PATH, 'r') as file:
+            return int(file.read())
+    except (IOError, ValueError):
+        return 4096
+
+# SPI traffic counters of the active platform, see spi_stats()
+_spi_stats = {'bytes': 0, 'transfers': 0, 'seconds': 0.0}
+
+def _count_spi(nbytes, start):
+    _spi_stats['bytes'] += nbytes
+    _spi_stats['transfers'] += 1
+    _spi_stats['seconds'] += time.perf_counter() - start
+
+def spi_stats():
+    stats = dict(_spi_stats)
+    stats['platform'] = type(implementation).__name__
+    stats['transport'] = implementation.SPI_TRANSPORT  # 'spidev', or 'software' on a Jetson without it
+    return stats
+
+def reset_spi_stats():
+    _spi_stats.update(bytes=0, transfers=0, seconds=0.0)
+
+def _write_chunked(write, data, chunk):
+    # one write per spidev buffer, slicing a memoryview so nothing gets copied
+    if not isinstance(data, (bytes, bytearray)):
+        data = bytes(data)
+    view = memoryview(data)
+    for i in range(0, len(view), chunk):
+        write(view[i:i + chunk])
+
 
 class RaspberryPi:
     # Pin definition
@@ -42,6 +81,9 @@ class RaspberryPi:
     CS_PIN   = 8
     BUSY_PIN = 24
     PWR_PIN  = 18
+    SPI_SPEED_HZ = 4000000
+    SPI_BUFSIZ   = 4096
+    SPI_TRANSPORT = 'spidev'
 
     def __init__(self):
         import spidev
@@ -59,11 +101,19 @@ class RaspberryPi:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def set_spi_speed(self, hz):
+        # takes effect on the next module_init(), i.e. the next init()
+        self.SPI_SPEED_HZ = int(hz)
+
     def spi_writebyte(self, data):
+        start = time.perf_counter()
         self.SPI.writebytes(data)
+        _count_spi(len(data), start)
 
     def spi_writebyte2(self, data):
-        self.SPI.writebytes2(data)
+        start = time.perf_counter()
+        _write_chunked(self.SPI.writebytes2, data, self.SPI_BUFSIZ)
+        _count_spi(len(data), start)
 
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
@@ -78,7 +128,8 @@ class RaspberryPi:
 
         # SPI device, bus = 0, device = 0
         self.SPI.open(0, 0)
-        self.SPI.max_speed_hz = 4000000
+        self.SPI_BUFSIZ = spidev_bufsiz()
+        self.SPI.max_speed_hz = spi_speed_hz(self.SPI_SPEED_HZ)
         self.SPI.mode = 0b00
         return 0
 
@@ -101,27 +152,48 @@ class JetsonNano:
     CS_PIN   = 8
     BUSY_PIN = 24
     PWR_PIN  = 18
+    SPI_SPEED_HZ = 4000000
+    SPI_BUFSIZ   = 4096
+
+    # kernel SPI device (bus 0, device 0), enabled with jetson-io
+    SPIDEV_PATH = '/dev/spidev0.0'
 
     def __init__(self):
         import ctypes
-        find_dirs = [
-            os.path.dirname(os.path.realpath(__file__)),
-            '/usr/local/lib',
-            '/usr/lib',
-        ]
         self.SPI = None
-        for find_dir in find_dirs:
-            so_filename = os.path.join(find_dir, 'sysfs_software_spi.so')
-            if os.path.exists(so_filename):
-                self.SPI = ctypes.cdll.LoadLibrary(so_filename)
-                break
+        self.SPI_TRANSPORT = None
+
+        # Prefer the hardware SPI controller through spidev, it sends a whole
+        # buffer per ioctl. The bit-banged sysfs_software_spi.so is the fallback.
+        if os.path.exists(self.SPIDEV_PATH):
+            try:
+                import spidev
+                self.SPI = spidev.SpiDev()
+                self.SPI_TRANSPORT = 'spidev'
+            except ImportError:
+                logger.debug("spidev module not installed, using software SPI")
+
+        if self.SPI is None:
+            find_dirs = [
+                os.path.dirname(os.path.realpath(__file__)),
+                '/usr/local/lib',
+                '/usr/lib',
+            ]
+            for find_dir in find_dirs:
+                so_filename = os.path.join(find_dir, 'sysfs_software_spi.so')
+                if os.path.exists(so_filename):
+                    self.SPI = ctypes.cdll.LoadLibrary(so_filename)
+                    self.SPI_TRANSPORT = 'software'
+                    break
         if self.SPI is None:
-            raise RuntimeError('Cannot find sysfs_software_spi.so')
+            raise RuntimeError('Cannot find %s or sysfs_software_spi.so' % self.SPIDEV_PATH)
 
         import Jetson.GPIO
         self.GPIO = Jetson.GPIO
 
     def digital_write(self, pin, value):
+        if pin == self.CS_PIN and self.SPI_TRANSPORT == 'spidev':
+            return  # chip select is driven by the SPI controller
         self.GPIO.output(pin, value)
 
     def digital_read(self, pin):
@@ -130,37 +202,69 @@ class JetsonNano:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def set_spi_speed(self, hz):
+        # takes effect on the next module_init(); software SPI has no clock setting
+        self.SPI_SPEED_HZ = int(hz)
+
     def spi_writebyte(self, data):
-        self.SPI.SYSFS_software_spi_transfer(data[0])
+        start = time.perf_counter()
+        if self.SPI_TRANSPORT == 'spidev':
+            self.SPI.writebytes(data)
+        else:
+            self.SPI.SYSFS_software_spi_transfer(data[0])
+        _count_spi(len(data), start)
 
     def spi_writebyte2(self, data):
-        for i in range(len(data)):
-            self.SPI.SYSFS_software_spi_transfer(data[i])
+        start = time.perf_counter()
+        if self.SPI_TRANSPORT == 'spidev':
+            _write_chunked(self.SPI.writebytes2, data, self.SPI_BUFSIZ)
+        else:
+            for i in range(len(data)):
+                self.SPI.SYSFS_software_spi_transfer(data[i])
+        _count_spi(len(data), start)
 
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
         self.GPIO.setwarnings(False)
         self.GPIO.setup(self.RST_PIN, self.GPIO.OUT)
         self.GPIO.setup(self.DC_PIN, self.GPIO.OUT)
-        self.GPIO.setup(self.CS_PIN, self.GPIO.OUT)
+        if self.SPI_TRANSPORT != 'spidev':
+            self.GPIO.setup(self.CS_PIN, self.GPIO.OUT)
         self.GPIO.setup(self.PWR_PIN, self.GPIO.OUT)
         self.GPIO.setup(self.BUSY_PIN, self.GPIO.IN)
         
         self.GPIO.output(self.PWR_PIN, 1)
         
-        self.SPI.SYSFS_software_spi_begin()
+        logger.info("Jetson SPI transport: %s", self.SPI_TRANSPORT)
+        if self.SPI_TRANSPORT == 'software':
+            # frames go out many times slower this way, so say so where it is seen
+            print("Jetson SPI: no spidev at %s, using the software SPI library" % self.SPIDEV_PATH)
+        if self.SPI_TRANSPORT == 'spidev':
+            # SPI device, bus = 0, device = 0
+            self.SPI.open(0, 0)
+            self.SPI_BUFSIZ = spidev_bufsiz()
+            self.SPI.max_speed_hz = spi_speed_hz(self.SPI_SPEED_HZ)
+            self.SPI.mode = 0b00
+        else:
+            self.SPI.SYSFS_software_spi_begin()
         return 0
 
     def module_exit(self):
         logger.debug("spi end")
-        self.SPI.SYSFS_software_spi_end()
+        if self.SPI_TRANSPORT == 'spidev':
+            self.SPI.close()
+        else:
+            self.SPI.SYSFS_software_spi_end()
 
         logger.debug("close 5V, Module enters 0 power consumption ...")
         self.GPIO.output(self.RST_PIN, 0)
         self.GPIO.output(self.DC_PIN, 0)
         self.GPIO.output(self.PWR_PIN, 0)
 
-        self.GPIO.cleanup([self.RST_PIN, self.DC_PIN, self.CS_PIN, self.BUSY_PIN, self.PWR_PIN])
+        if self.SPI_TRANSPORT == 'spidev':
+            self.GPIO.cleanup([self.RST_PIN, self.DC_PIN, self.BUSY_PIN, self.PWR_PIN])
+        else:
+            self.GPIO.cleanup([self.RST_PIN, self.DC_PIN, self.CS_PIN, self.BUSY_PIN, self.PWR_PIN])
 
 
 class SunriseX3:
@@ -171,6 +275,9 @@ class SunriseX3:
     BUSY_PIN = 24
     PWR_PIN  = 18
     Flag     = 0
+    SPI_SPEED_HZ = 4000000
+    SPI_BUFSIZ   = 4096
+    SPI_TRANSPORT = 'spidev'
 
     def __init__(self):
         import spidev
@@ -188,13 +295,22 @@ class SunriseX3:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def set_spi_speed(self, hz):
+        self.SPI_SPEED_HZ = int(hz)
+        if self.Flag == 1:
+            # module_init() only opens the device once, apply to the open device
+            self.SPI.max_speed_hz = spi_speed_hz(self.SPI_SPEED_HZ)
+
     def spi_writebyte(self, data):
+        start = time.perf_counter()
         self.SPI.writebytes(data)
+        _count_spi(len(data), start)
 
     def spi_writebyte2(self, data):
-        # for i in range(len(data)):
-        #     self.SPI.writebytes([data[i]])
-        self.SPI.xfer3(data)
+        # write only: xfer3 is full duplex and builds a receive list as big as the frame
+        start = time.perf_counter()
+        _write_chunked(self.SPI.writebytes2, data, self.SPI_BUFSIZ)
+        _count_spi(len(data), start)
 
     def module_init(self):
         if self.Flag == 0:
@@ -211,7 +327,8 @@ class SunriseX3:
         
             # SPI device, bus = 0, device = 0
             self.SPI.open(2, 0)
-            self.SPI.max_speed_hz = 4000000
+            self.SPI_BUFSIZ = spidev_bufsiz()
+            self.SPI.max_speed_hz = spi_speed_hz(self.SPI_SPEED_HZ)
             self.SPI.mode = 0b00
             return 0
         else:
@@ -230,6 +347,28 @@ class SunriseX3:
         self.GPIO.cleanup([self.RST_PIN, self.DC_PIN, self.CS_PIN, self.BUSY_PIN], self.PWR_PIN)
 
 
+# byte -> inverted byte, for bulk inversion of packed 1bpp frames
+INVERT_TABLE = bytes(0xFF ^ i for i in range(256))
+
+def getbuffer_1bpp(image, width, height, invert=False):
+    # Pack a PIL image into a 1bpp frame buffer (MSB first, one row after the other)
+    # in bulk, instead of walking the pixels in Python. A portrait image (height x width)
+    # is rotated to the panel orientation first. PIL uses 0=black and 1=white; pass
+    # invert=True for controllers that want 1=black. Returns None on a size mismatch.
+    imwidth, imheight = image.size
+    if imwidth == width and imheight == height:
+        image = image.convert('1')
+    elif imwidth == height and imheight == width:
+        image = image.rotate(90, expand=True).convert('1')
+    else:
+        return None
+
+    buf = image.tobytes('raw')
+    if invert:
+        buf = buf.translate(INVERT_TABLE)
+    return bytearray(buf)
+
+
 if os.path.exists('/sys/bus/platform/drivers/gpiomem-bcm2835'):
     implementation = RaspberryPi()
 elif os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
@@ -0,0 +1,79 @@
+# wordwrap
+#
+# Word wrapping against the real pixel width of the panel, using the font's
+# advance widths instead of a fixed number of characters per line.
+#
+# A paragraph's layout is kept as a list of break offsets: the index in the
+# paragraph text where each display line starts (the first one is always 0).
+# A space that ends a line is swallowed by the break, like a typewriter would.
+# Words wider than a whole line are split at the last character that fits.
+
+from bisect import bisect_right
+
+
+class WordWrap:
+    def __init__(self, font, max_width):
+        self.font = font
+        self.max_width = max_width
+        self.advances = {}  # char -> advance width in pixels
+
+    def advance(self, ch):
+        width = self.advances.get(ch)
+        if width is None:
+            width = self.font.getlength(ch)
+            self.advances[ch] = width
+        return width
+
+    def width(self, text):
+        return sum(self.advance(ch) for ch in text)
+
+    def next_break(self, text, start):
+        # start offset of the line after the one starting at start, None if the rest fits
+        width = 0
+        last_space = -1
+        for i in range(start, len(text)):
+            ch = text[i]
+            width += self.advance(ch)
+            if width > self.max_width:
+                if ch == ' ':
+                    return i + 1
+                if last_space >= start:
+                    return last_space + 1
+                return max(i, start + 1)  # a word longer than the line
+            if ch == ' ':
+                last_space = i
+        return None
+
+    def breaks(self, text, start=0, breaks=None):
+        # line starts of text, continuing from a known line start
+        if breaks is None:
+            breaks = [start]
+        b = self.next_break(text, start)
+        while b is not None and b < len(text):
+            breaks.append(b)
+            b = self.next_break(text, b)
+        return breaks
+
+    def reflow(self, text, old_breaks, pos, removed, inserted):
+        # Re-wrap text after removed chars at pos were replaced by inserted chars.
+        # Only lines from the one before the edit are recomputed, and only until a
+        # break lines up with an old one again: greedy wrapping from the same
+        # offset of the same text gives the same breaks from there on.
+        delta = inserted - removed
+        line = max(bisect_right(old_breaks, pos) - 2, 0)
+        breaks = old_breaks[:line + 1]
+        old = {b: i for i, b in enumerate(old_breaks)}
+
+        b = self.next_break(text, breaks[-1])
+        while b is not None and b < len(text):
+            if b >= pos + inserted and b - delta in old:
+                j = old[b - delta]
+                breaks.extend(ob + delta for ob in old_breaks[j:])
+                return breaks
+            breaks.append(b)
+            b = self.next_break(text, b)
+        return breaks
+
+    def lines(self, text, breaks):
+        ends = breaks[1:] + [len(text)]
+        return [text[start:end] for start, end in zip(breaks, ends)]
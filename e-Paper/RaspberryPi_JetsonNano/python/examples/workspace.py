@@ -0,0 +1,129 @@
+# workspace
+#
+# The documents open at once, most recently used first, each backed by its own
+# file in data/ (the first one ever is cache.txt). The list is kept in
+# data/workspace.json so the same documents are open after a restart.
+#
+# Recently used documents stay resident: their Document, undo log, stats and
+# the last frame shown for them, so switching back is a framebuffer push. When
+# the resident ones add up to more than budget bytes, the least recently used
+# are saved to their file and dropped; switching to one of those loads it again
+# (which the line index keeps cheap) and renders it. Saves go through the
+# editor's saver.Saver, so a load waits for any save of that file still queued.
+
+import os
+import json
+import document
+import undo
+import stats
+import iostats
+
+WORKSPACE_NAME = 'workspace.json'
+FRAME_BYTES = 2 * 800 * 480 // 8  # a kept frame: image plus packed buffer, about
+
+
+class Entry:
+    def __init__(self, path):
+        self.path = path
+        self.doc = None  # None while evicted
+        self.undo = None
+        self.stats = None
+        self.frame = None  # (version, image, buffer) last shown
+        self.scroll = 1
+        self.cursor = None  # (paragraph, offset), None for the end of the document
+
+    def memory(self):
+        # rough resident bytes
+        if self.doc is None:
+            return 0
+        used = self.doc.memory() + self.undo.size
+        if self.frame is not None:
+            used += FRAME_BYTES
+        return used
+
+
+class Workspace:
+    def __init__(self, directory, wrap, undo_memory, saver, budget=4 * 1024 * 1024):
+        self.directory = directory
+        self.wrap = wrap
+        self.undo_memory = undo_memory
+        self.saver = saver
+        self.budget = budget
+        self.path = os.path.join(directory, WORKSPACE_NAME)
+        try:
+            with open(self.path, 'r') as file:
+                names = json.load(file)
+        except (OSError, ValueError):
+            names = []
+        self.entries = [Entry(os.path.join(directory, name)) for name in names]  # most recent first
+        if not self.entries:
+            self.entries = [Entry(os.path.join(directory, 'cache.txt'))]
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump([os.path.basename(entry.path) for entry in self.entries], file)
+            written = file.tell()
+        os.replace(temp_path, self.path)
+        iostats.count('workspace', written)
+
+    def current(self):
+        return self.entries[0]
+
+    def resident(self, entry, now):
+        # make sure the entry's document is loaded
+        if entry.doc is None:
+            self.saver.flush()
+            entry.doc = document.Document(self.wrap)
+            try:
+                entry.doc.load(entry.path)
+            except FileNotFoundError:
+                pass
+            entry.undo = undo.UndoLog(self.undo_memory)
+            entry.stats = stats.Stats(now)
+            entry.stats.reset(*entry.doc.totals(), now)
+        return entry
+
+    def switch(self, entry, now):
+        # entry becomes the current document
+        self.entries.remove(entry)
+        self.entries.insert(0, entry)
+        self.resident(entry, now)
+        self.evict()
+        self.save()
+        return entry
+
+    def new(self, name, now):
+        entry = Entry(os.path.join(self.directory, name))
+        self.entries.insert(0, entry)
+        return self.switch(entry, now)
+
+    def close(self, entry, now):
+        # forget the entry (its file stays), returns the new current document
+        if entry.doc is not None:
+            entry.doc.close()
+        self.entries.remove(entry)
+        if not self.entries:
+            self.entries = [Entry(os.path.join(self.directory, 'cache.txt'))]
+        return self.switch(self.entries[0], now)
+
+    def evict(self):
+        # save and drop the least recently used documents until under budget;
+        # the current one always stays
+        used = sum(entry.memory() for entry in self.entries)
+        for entry in reversed(self.entries[1:]):
+            if used <= self.budget:
+                break
+            if entry.doc is None:
+                continue
+            used -= entry.memory()
+            self.saver.save(entry.path, entry.doc.snapshot())
+            entry.doc.close()
+            entry.doc = None
+            entry.undo = None
+            entry.stats = None
+            entry.frame = None
+
+    def other(self):
+        # the most recently used document besides the current one
+        return self.entries[1] if len(self.entries) > 1 else None
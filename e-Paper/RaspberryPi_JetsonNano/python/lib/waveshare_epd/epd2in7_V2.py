@@ -96,6 +96,13 @@ class EPD:
         epdconfig.digital_write(self.cs_pin, 0)
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
+
+    # send a lot of data   
+    def send_data2(self, data):
+        epdconfig.digital_write(self.dc_pin, 1)
+        epdconfig.digital_write(self.cs_pin, 0)
+        epdconfig.spi_writebyte2(data)
+        epdconfig.digital_write(self.cs_pin, 1)
         
     def ReadBusy(self):        
         logger.debug("e-Paper busy")
@@ -435,11 +442,13 @@ class EPD:
         self.send_data(Ystart & 0xff)
         self.send_data((Ystart>>8) & 0x01)
 
+        # Copy only the window rows out of the frame, then send them in one go
+        buf = bytearray()
+        for j in range(max(Ystart, 0), min(Yend + 1, Height)):
+            buf.extend(Image[j * Width + Xstart : j * Width + min(Xend + 1, Width)])
+
         self.send_command(0x24)   #Write Black and White image to RAM
-        for j in range(Height):
-            for i in range(Width):
-                if((j > Ystart-1) & (j < (Yend + 1)) & (i > Xstart-1) & (i < (Xend + 1))):
-                    self.send_data(Image[i + j * Width])
+        self.send_data2(buf)
         self.TurnOnDisplay_Partial()
   
     def display_4Gray(self, image):
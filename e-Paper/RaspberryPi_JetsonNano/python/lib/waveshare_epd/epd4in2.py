@@ -57,7 +57,9 @@ class EPD:
         self.GRAY2 = GRAY2
         self.GRAY3 = GRAY3  # gray
         self.GRAY4 = GRAY4  # Blackest
-        self.DATA = [0x00] * 15000
+        # shadow of the panel's 0x13 RAM, used as the old data for partial updates.
+        # Partial updates take the image inverted, so it is kept inverted: white is 0x00.
+        self.DATA = bytearray(int(EPD_WIDTH / 8) * EPD_HEIGHT)
 
     lut_vcom0 = [
         0x00, 0x08, 0x08, 0x00, 0x00, 0x02,
@@ -510,6 +512,7 @@ class EPD:
 
         self.send_command(0x13)
         self.send_data2(image)
+        self.DATA[:] = bytes(image).translate(epdconfig.INVERT_TABLE)
 
         self.send_command(0x12)
         self.ReadBusy()
@@ -524,49 +527,53 @@ class EPD:
             Width = int(EPD_WIDTH / 8)
         Height = EPD_HEIGHT
 
-        if X_start % 8 != 0:
-            X_start = int(X_start / 8) + 1
-        else:
-            X_start = int(X_start / 8)
+        # The window is byte aligned: round the start down and the end up
+        X_start = X_start // 8
         if X_end % 8 != 0:
-            X_end = int(X_end / 8) + 1
+            X_end = X_end // 8 + 1
         else:
-            X_end = int(X_end / 8)
-
-        buf = [0x00] * (Y_end - Y_start) * (X_end - X_start)
+            X_end = X_end // 8
+        X_end = min(X_end, Width)
+        Y_start = max(Y_start, 0)
+        Y_end = min(Y_end, Height)
+        if X_end <= X_start or Y_end <= Y_start:
+            return
 
         self.send_command(0x91)  # This command makes the display enter partial mode
         self.send_command(0x90)  # resolution setting
-        self.send_data(int(X_start * 8 / 256))
-        self.send_data(int(X_start * 8 % 256))  # x-start
+        self.send_data((X_start * 8) >> 8)
+        self.send_data((X_start * 8) & 0xff)  # x-start
 
-        self.send_data(int(X_end * 8 / 256))
-        self.send_data(int(X_end * 8 % 256) - 1)  # x-end
+        self.send_data((X_end * 8 - 1) >> 8)
+        self.send_data((X_end * 8 - 1) & 0xff)  # x-end
 
-        self.send_data(int(Y_start / 256))
-        self.send_data(int(Y_start % 256))  # y-start
+        self.send_data(Y_start >> 8)
+        self.send_data(Y_start & 0xff)  # y-start
 
-        self.send_data(int(Y_end / 256))
-        self.send_data(int(Y_end % 256) - 1)  # y-end
+        self.send_data((Y_end - 1) >> 8)
+        self.send_data((Y_end - 1) & 0xff)  # y-end
         self.send_data(0x28)
 
+        old = bytearray()
+        new = bytearray()
+        for j in range(Y_start, Y_end):
+            row = slice(j * Width + X_start, j * Width + X_end)
+            old += self.DATA[row]
+            self.DATA[row] = bytes(Image[row]).translate(epdconfig.INVERT_TABLE)
+            new += self.DATA[row]
+
         self.send_command(0x10)  # writes Old data to SRAM for programming
-        for j in range(0, Y_end - Y_start):
-            for i in range(0, X_end - X_start):
-                buf[j * (X_end - X_start) + i] = self.DATA[(Y_start + j) * Width + X_start + i]
-        self.send_data2(buf)
+        self.send_data2(old)
 
         self.send_command(0x13)  # writes New data to SRAM.
-        for j in range(0, Y_end - Y_start):
-            for i in range(0, X_end - X_start):
-                buf[j * (X_end - X_start) + i] = ~Image[(Y_start + j) * Width + X_start + i]
-                self.DATA[(Y_start + j) * Width + X_start + i] = ~Image[(Y_start + j) * Width + X_start / 8 + i]
-        self.send_data2(buf)
+        self.send_data2(new)
 
         self.send_command(0x12)  # DISPLAY REFRESH
         epdconfig.delay_ms(200)  # The delay here is necessary, 200uS at least!!!
         self.ReadBusy()
 
+        self.send_command(0x92)  # leave partial mode
+
     def display_4Gray(self, image):
         self.send_command(0x92)
         self.set_lut()
@@ -662,6 +669,7 @@ class EPD:
 
         self.send_command(0x13)
         self.send_data2([0xff] * int(self.height * linewidth))
+        self.DATA[:] = bytes(len(self.DATA))  # white, inverted
 
         self.send_command(0x12)
         self.ReadBusy()